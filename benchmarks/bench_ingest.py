@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+""" Micro-benchmarks of ingestion stages on fixed synthetic datasets.
+
+    Run with the Python Splunk uses for the add-on, e.g.:
+        $SPLUNK_HOME/bin/splunk cmd python3 benchmarks/bench_ingest.py --size 100k
+    Reports ops/sec and peak traced memory per stage and compares ops/sec
+    with benchmarks/baseline.json. Exits with 1 when a stage is slower than
+    its baseline by more than --tolerance.
+"""
+
+import os
+import sys
+import io
+import csv
+import json
+import time
+import random
+import logging
+import argparse
+import tracemalloc
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                       '..', 'splunk-app', 'monobankAddonForSplunk', 'bin')
+sys.path.insert(0, BIN_DIR)
+
+import pytz
+from splunklib import modularinput
+from splunklib.results import ResultsReader
+from splunklib.searchcommands.internals import RecordWriterV2
+from monobankAPImi import CustomJsonFormatter
+
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'baseline.json')
+# memory is traced on a prefix of the dataset to keep tracemalloc overhead bounded
+ALLOC_SAMPLE = 10000
+PAGE_SIZE = 500
+SEED = 20240101
+TZ = pytz.timezone('Europe/Kiev')
+DESCRIPTIONS = ['Сільпо', 'АТБ', 'Uber', 'Netflix.com', 'Bolt', 'Нова Пошта',
+                'Rozetka', 'Google Cloud', 'Кафе Львівські круасани', 'Від: Олена']
+MCCS = [5411, 5499, 4121, 4899, 5812, 5814, 5912, 4829, 6011, 5732]
+
+
+def transactions(count):
+    """ Deterministic statement items, newest first like Monobank returns them """
+    rnd = random.Random(SEED)
+    items = []
+    timestamp = 1700000000
+    balance = 10000000
+    for number in range(count):
+        amount = rnd.choice((-1, -1, -1, 1)) * rnd.randint(100, 500000)
+        balance += amount
+        timestamp -= rnd.randint(30, 7200)
+        items.append({
+            'id': 'ZuHWzqkKGVo%08d' % number,
+            'time': timestamp,
+            'description': rnd.choice(DESCRIPTIONS),
+            'mcc': rnd.choice(MCCS),
+            'originalMcc': rnd.choice(MCCS),
+            'hold': rnd.random() < 0.1,
+            'amount': amount,
+            'operationAmount': amount,
+            'currencyCode': 980,
+            'commissionRate': 0,
+            'cashbackAmount': rnd.randint(0, 500),
+            'balance': balance,
+            'comment': None,
+            'receiptId': 'XXXX-XXXX-XXXX-%04d' % (number % 10000)
+        })
+    return items
+
+
+def pages(items):
+    """ Statement response bodies of max PAGE_SIZE items """
+    return [json.dumps(items[start:start + PAGE_SIZE]).encode('utf-8')
+            for start in range(0, len(items), PAGE_SIZE)]
+
+
+def results_xml(items):
+    """ Search results XML as returned by Splunk REST """
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<results preview="0">\n'
+             '<meta><fieldOrder><field>id</field><field>timestamp</field>'
+             '<field>description</field></fieldOrder></meta>\n']
+    for item in items:
+        parts.append('<result><field k="id"><value><text>%s</text></value></field>'
+                     '<field k="timestamp"><value><text>%d</text></value></field>'
+                     '<field k="description"><value><text>%s</text></value></field>'
+                     '</result>\n' % (item['id'], item['time'], escape(item['description'])))
+    parts.append('</results>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+def bench_decode(data):
+    """ JSON decode of statement pages """
+    count = 0
+    for page in data['pages']:
+        count += len(json.loads(page))
+    return count
+
+
+def bench_event_write_to(data):
+    """ Event.write_to of serialized items """
+    stream = io.StringIO()
+    for line in data['lines']:
+        modularinput.Event(data=line, index='main', sourcetype='_json').write_to(stream)
+    return len(data['lines'])
+
+
+def bench_event_writer(data):
+    """ EventWriter.write_event, including item serialization """
+    writer = modularinput.EventWriter(output=io.StringIO(), error=io.StringIO())
+    for item in data['items']:
+        writer.write_event(modularinput.Event(data=json.dumps(item), index='main',
+                                              sourcetype='_json'))
+    writer.close()
+    return len(data['items'])
+
+
+def bench_log_format(data):
+    """ CustomJsonFormatter.format of log records """
+    formatter = CustomJsonFormatter('%(timestamp)s %(level)s %(message)s')
+    count = 0
+    for item in data['items']:
+        record = logging.LogRecord('bench', logging.INFO, __file__, 0, 'Window emitted',
+                                   None, None)
+        record.window = {'from': item['time'], 'to': item['time'] + 1}
+        formatter.format(record)
+        count += 1
+    return count
+
+
+def bench_results_reader(data):
+    """ ResultsReader parsing of search results """
+    count = 0
+    for _ in ResultsReader(io.BytesIO(data['results_xml'])):
+        count += 1
+    return count
+
+
+def bench_record_writer(data):
+    """ RecordWriter._write_record of search command records """
+    writer = RecordWriterV2(io.BytesIO(), maxresultrows=len(data['items']) + 1)
+    for item in data['items']:
+        writer._write_record(item)
+    return len(data['items'])
+
+
+def bench_timezone(data):
+    """ Kyiv day of transaction time and localized day start """
+    for item in data['items']:
+        day = datetime.fromtimestamp(item['time'], TZ).date()
+        TZ.localize(datetime.combine(day, datetime.min.time())).timestamp()
+    return len(data['items'])
+
+
+BENCHMARKS = [
+    ('decode', bench_decode),
+    ('event_write_to', bench_event_write_to),
+    ('event_writer', bench_event_writer),
+    ('log_format', bench_log_format),
+    ('results_reader', bench_results_reader),
+    ('record_writer', bench_record_writer),
+    ('timezone', bench_timezone),
+]
+
+
+def dataset(count):
+    """ Inputs of all benchmarks for count transactions """
+    items = transactions(count)
+    return {
+        'items': items,
+        'lines': [json.dumps(item) for item in items],
+        'pages': pages(items),
+        'results_xml': results_xml(items),
+    }
+
+
+def measure(bench, data, sample):
+    """ ops/sec of the full dataset and peak traced KiB of the sample """
+    started = time.perf_counter()
+    ops = bench(data)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    sample_ops = bench(sample)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'ops': ops,
+        'ops_per_sec': round(ops / elapsed, 1),
+        'peak_kib_per_1k_ops': round(peak / 1024 / sample_ops * 1000, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', action='append', choices=sorted(SIZES),
+                        help='dataset size, may be repeated (default: 1k and 100k)')
+    parser.add_argument('--only', action='append', help='run only the named benchmark')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed ops/sec drop against baseline (default: 0.25)')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+    results = {}
+    regressions = 0
+    writer = csv.writer(sys.stdout, delimiter='\t', lineterminator='\n')
+    writer.writerow(['size', 'stage', 'ops/sec', 'baseline', 'change', 'peak KiB/1k ops'])
+    for size in args.size or ['1k', '100k']:
+        data = dataset(SIZES[size])
+        sample = dataset(min(SIZES[size], ALLOC_SAMPLE))
+        for name, bench in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            result = measure(bench, data, sample)
+            results.setdefault(size, {})[name] = result
+            expected = baseline.get(size, {}).get(name, {}).get('ops_per_sec')
+            change = ''
+            if expected:
+                ratio = result['ops_per_sec'] / expected - 1
+                change = '%+.1f%%' % (ratio * 100)
+                if ratio < -args.tolerance:
+                    change += ' REGRESSION'
+                    regressions += 1
+            writer.writerow([size, name, result['ops_per_sec'], expected or '', change,
+                             result['peak_kib_per_1k_ops']])
+    if args.save_baseline:
+        for size, stages in results.items():
+            baseline.setdefault(size, {}).update(stages)
+        with open(args.baseline, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+            file.write('\n')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
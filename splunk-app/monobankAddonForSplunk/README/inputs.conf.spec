@@ -4,4 +4,142 @@ python.version = python3
 init_date = <value>
 card_id = <value>
 token = <value>
+* Monobank token. On the first run it is stored in storage/passwords
+* (realm monobankAddonForSplunk, username <stanza name>) and replaced here
+* by ********. Set a plain token again to replace the stored one.
+discover_accounts = <value>
+* Fetch statements of all accounts and jars returned by client-info,
+* events of every account get source <stanza>/<account id>
+enrich = <value>
+* Add currency, operationAmountValue, amountValue, balanceValue and
+* mccCategory fields from lookups/iso4217.csv and lookups/mcc_categories.csv
+normalize_merchants = <value>
+* Add merchant field: description lowercased without payment processor
+* prefix, terminal suffix, domain, numbers, city, country and legal form
+* tokens (e.g. NETFLIX.COM*1234 -> netflix), for low-cardinality stats.
+category_rules = <value>
+* Lookup file name (e.g. category_rules.csv) or absolute path of rules
+* adding a category field. Columns: category, description (case-insensitive
+* substring), regex (case-insensitive, searched in description), mcc_from,
+* mcc_to, amount_min, amount_max (amount in major units, negative for
+* spending); empty columns are not checked and the first matching rule wins.
+* The file is read again when it changes.
+base_currency = <value>
+* ISO 4217 alpha code (e.g. UAH, EUR) of amount_base field, operationAmount
+* in major units of this currency. Rates are kept per day from /bank/currency
+* snapshots (fetched at most hourly) in the checkpoint directory; a day
+* without snapshot uses the closest earlier one, history before the first
+* snapshot uses the first one.
+indexed_fields = <value>
+* Add card (account id) and amountBucket (signed power of ten of amount in
+* major units, e.g. -100 for -100.00..-999.99) fields. With sourcetype
+* monobank:transaction card, mcc, currencyCode, hold and amountBucket are
+* also written as index-time fields mono_card, mono_mcc, mono_currency_code,
+* mono_hold and mono_amount_bucket, e.g. | tstats count where
+* sourcetype=monobank:transaction by mono_card, mono_mcc. Keep these field
+* names out of rename_fields.
+balance_check = <value>
+* Check previous balance + amount == balance over consecutive transactions
+* of every account. A break is logged (Balance gap) with the time range
+* between the two transactions, the later one gets balanceGap = true and
+* the range is fetched again by the next run.
+match_transfers = <value>
+* Pair a debit of one account with a credit of the same absolute operation
+* amount and currency of another account of the input (discover_accounts)
+* within about two minutes. Both legs get the same transferId. Windows of the
+* same range of all accounts are written together; a leg written before its
+* pair arrived (window border, webhook) is written again with updated = true.
+* Later versions of matched legs (revisit_days, webhook) keep transferId.
+* Transfers between own cards are excluded with `monobank_external`
+* (NOT superseded=true NOT transferId=*).
+metrics_index = <value>
+* Metrics index for daily spend rollups (sourcetype monobank:rollup),
+* dimensions day, card, currencyCode, mcc, measures monobank.amount.sum,
+* monobank.amount.count, monobank.amount.min, monobank.amount.max,
+* monobank.operationAmount.sum, monobank.cashbackAmount.sum in minor units.
+* A point is written only when the group changes: sum and count measures
+* are deltas against the previous point, so | mstats sum(...) gives totals;
+* min and max are the values of the whole group at the time of the point.
+* Run telemetry (phase timings, bytes, retries, peak RSS) goes to the same
+* index as monobank.run.* measures with sourcetype monobank:telemetry.
+catch_up = <value>
+* Backfill order: oldest_first (default) or newest_first. newest_first
+* fetches the most recent windows (of all accounts) first and then fills
+* history backwards; every window's progress is kept in the journal,
+* so interrupted runs resume in both directions.
+revisit_days = <value>
+* Days before the last ingested window fetched again every run. A content
+* hash is kept per transaction id and only transactions which changed
+* (e.g. hold settled, amount or description edited) are ingested again,
+* with updated = true (see Superseded events below).
+* Transactions posted late into the range are ingested too, except those
+* older than the hash index (created when revisiting is enabled). Hashes
+* are kept for revisit_days + 31 days, at least 62 days.
+* 0 (default) disables revisiting.
+webhook_listen = <value>
+* [host:]port of local webhook receiver (host defaults to 127.0.0.1).
+* When set the input runs continuously (use interval = 0): StatementItem
+* posts are written as they arrive and statements are polled every
+* reconcile_interval seconds, dropping transactions already received.
+webhook_url = <value>
+* Public URL (e.g. reverse proxy to webhook_listen) registered in Monobank,
+* its path is the only one the receiver accepts
+reconcile_interval = <value>
+* Statement reconciliation period in webhook mode, default 3600
+import_dir = <value>
+* Work directory for bulk import of statement history without API limits.
+* Every run first imports files from <import_dir>/inbound, then polls the
+* API: CSV statements exported from the Monobank app, CSV with API field
+* names and JSON dumps of statement responses (.json, .jsonl). Items are
+* deduplicated by id (content hash for app exports) and processed files are
+* moved to <import_dir>/inbound/archive. Rows which can not be parsed (e.g. a
+* total line) are skipped with a warning, files which can not be read are
+* moved to <import_dir>/inbound/rejected. Events get the input source, so
+* import history older than the first API window.
+archive = <value>
+* Append every fetched statement window to a compressed archive in the
+* checkpoint directory (<input>.archive.gz, gzip members readable with
+* zcat, indexed by card and window in <input>.archive.idx).
+replay = <value>
+* Re-ingest archived windows ending after init_date instead of calling the
+* API, e.g. after an index rebuild or a sourcetype change. Transactions
+* archived more than once are written once, in the latest fetched version.
+* Replay is one-shot: a completed replay is recorded in
+* <input>.archive.replayed and later runs only log a warning, unless
+* init_date is set earlier. An interrupted replay is repeated whole.
+spool = <value>
+* Append events to a segmented spool in the checkpoint directory
+* (<input>.spool) which a background thread drains to splunkd. Windows are
+* committed once their events are synced to the spool, so fetching goes on
+* at the API pace when splunkd reads slowly, and events spooled before a
+* restart are written by the next run (of an input with spool enabled).
+compact_json = <value>
+* Write event data with compact separators and unescaped unicode, which
+* reduces ingested bytes and license usage. Default false.
+fields = <value>
+* Comma separated fields written to events, empty (default) for all.
+* Applies to fields added by enrich too.
+exclude_fields = <value>
+* Comma separated fields not written to events, e.g. receiptId
+rename_fields = <value>
+* Comma separated from:to renames of written fields, e.g. amount:amt
+omit_empty = <value>
+* Do not write null and empty fields, and commissionRate / cashbackAmount
+* when they are 0. Searches must treat missing fields as defaults.
+profile = <value>
+* Profile every run of the input: cprofile, tracemalloc or sample
+* (periodic stack sampling, collapsed stacks). Artifacts are written to
+* $SPLUNK_HOME/var/log/monobank_profile, old ones are removed above 50MB.
+* cprofile merges a profiler per thread, so fetching in the prefetch thread
+* is included. MONOBANK_PROFILE environment variable profiles the whole
+* script run; per-input profiling is skipped while it is active.
 log_level = <value>
+
+# Superseded events
+# A transaction written again (updated = true) gets revision = previous + 1,
+# the first event has none (0). The input saves id and revision of the
+# replaced event to the KV store collection monobank_superseded and the
+# automatic lookup of source monobankAPImi://... sets superseded = true on
+# it, so reports count the latest versions with the plain field match
+# NOT superseded=true (macro `monobank_latest`). Keep id and revision in
+# fields and out of rename_fields.
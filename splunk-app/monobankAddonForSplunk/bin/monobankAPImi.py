@@ -7,14 +7,37 @@ import sys
 import os
 import logging
 import json
+import time
+from itertools import chain, groupby
+from operator import itemgetter
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
-from urllib.error import HTTPError
-import requests
 import pytz
 from splunklib import modularinput
 from pythonjsonlogger import jsonlogger
 from myutils import splunkutils
+from myutils import journal
+from myutils.monoapi import MonobankAPI, STATEMENT_MAX_SPAN
+from myutils.pipeline import Prefetcher, WindowOutput
+from myutils.refcache import ReferenceCache
+from myutils.enrich import Enricher, Tables, LOOKUPS_DIR
+from myutils.rollups import DailyRollup
+from myutils.telemetry import RunStats
+from myutils import profiling
+from myutils.seen import SeenIndex, SeenLog, ChangeDetector, retention
+from myutils.webhook import WebhookReceiver
+from myutils.indexed import IndexedFields
+from myutils.encoder import EventEncoder, parse_list, parse_mapping
+from myutils.importer import StatementImporter
+from myutils.archive import ResponseArchive
+from myutils.spool import Spool
+from myutils.balance import BalanceCheck
+from myutils.transfers import TransferMatcher
+from myutils.categorize import Categorizer
+from myutils.merchant import MerchantNormalizer
+from myutils.fx import FxConverter
+from myutils.credentials import Credentials, MASK, REALM
+from myutils.supersede import Supersessions
 
 
 SPLUNK_MI_NAME = 'Costs Monobank API'
@@ -29,9 +52,33 @@ if 'SPLUNK_HOME' in os.environ:
 else:
     log_dir = os.path.dirname(os.path.realpath(__file__))
     LOG_DIR = os.path.expandvars(log_dir)
+PROFILE_DIR = os.path.join(LOG_DIR, 'monobank_profile')
 INIT_DATE_FMT = '%Y-%m-%d'
 TZ = pytz.timezone('Europe/Kiev') # since this is bank from Ukraine
-REST_URI = 'https://api.monobank.ua/personal/statement/'
+# one day is left for windows to not hit API limit on the range borders
+WINDOW_SPAN = STATEMENT_MAX_SPAN - 24 * 3600
+# windows fetched ahead while events of the current one are written
+PREFETCH_DEPTH = 2
+ROLLUP_SOURCETYPE = 'monobank:rollup'
+TELEMETRY_SOURCETYPE = 'monobank:telemetry'
+CATCH_UP_MODES = ('oldest_first', 'newest_first')
+# shortest range of the first checkpoint search, widened until data is found
+CHECKPOINT_SPAN = 2 * 24 * 3600
+# webhook mode: statement reconciliation period, seconds
+RECONCILE_INTERVAL = 3600
+
+
+def is_true(value):
+    """ Parse boolean input parameter """
+    return str(value).strip().lower() in ('1', 'true', 't', 'yes', 'y')
+
+
+def ascending(items):
+    """ Sort statement items, which come newest first, by ascending time
+        keeping transactions of the same second in the order they were made
+    """
+    items.reverse()
+    items.sort(key=itemgetter('time'))
 
 
 class CustomJsonFormatter(jsonlogger.JsonFormatter):
@@ -50,7 +97,7 @@ class CustomJsonFormatter(jsonlogger.JsonFormatter):
             log_record['level'] = record.levelname
         # add custom static field in log message
         log_record['input_name'] = self.input_name
-        log_record['function'] = str(sys._getframe(10).f_code.co_name)
+        log_record['function'] = record.funcName
 
 
 class CostsModularInput(modularinput.Script):
@@ -65,11 +112,50 @@ class CostsModularInput(modularinput.Script):
         self.sourcetype = None
         self.mgmt_endpoint = None
         self.session_key = None
+        self.checkpoint_dir = None
+        # window stages: callables of (items, account) returning items
+        self.stages = []
+        self.metrics_index = None
+        self.rollup = None
+        # stages monobank() relies on, set per input
+        self.fx = None
+        self.balance = None
+        self.transfers = None
+        self.revisit_days = 0
+        self.interval = None
+        self.newest_first = False
+        self.output = None
+        self.stats = RunStats()
+        self.encoder = EventEncoder()
+        self.archive = None
+        self.spool = None
+        self.supersessions = None
+        self.app_service = None
+
+    def run(self, args):
+        """ Runs modular input with stdout flushed once per window """
+        self.output = WindowOutput(sys.stdout)
+        try:
+            return self.run_script(args, modularinput.EventWriter(output=self.output),
+                                   sys.stdin)
+        finally:
+            self.output.commit()
+
+    def _flush(self):
+        """ Flush events written so far to splunkd, or make them durable
+            in the spool
+        """
+        if self.spool is not None:
+            with self.stats.phase('spool_sync'):
+                self.spool.sync()
+        elif self.output is not None:
+            with self.stats.phase('flush'):
+                self.output.commit()
 
-    def _set_params(self):
+    def _set_params(self, source):
         self.splunk_query = '| tstats latest(_time) as timestamp where index=' + self.index + \
                 ' sourcetype=' + self.sourcetype + \
-                ' source=' + self.source + \
+                ' source=' + source + \
                 '| append [| makeresults ] ' \
                 '| eval timestamp = if(isnotnull(timestamp), timestamp, 0) ' \
                 '| stats max(timestamp) as timestamp'
@@ -86,40 +172,353 @@ class CostsModularInput(modularinput.Script):
                     timedelta(seconds=1)
         return final_date
 
-    def monobank(self, init_date, card_id, token):
-        """ get Monobank transactions """
+    def _checkpoint_timestamp(self, init_date, source):
+        """ Get start of not ingested range from Splunk """
         src_sdate = init_date.split('-')
         init_datetime = datetime(int(src_sdate[0]),
                            int(src_sdate[1]), int(src_sdate[2]))
-        tz_to_datetime = self._final_date()
-        self._set_params()
+        self._set_params(source)
         splunk_utils = splunkutils.ModularInput()
         splunk = splunkutils.Splunk()
         log.debug('Splunk checkpoint query', extra={'splunk_query': str(self.splunk_query)})
-        splunk_latest_dt = splunk_utils.get_init_datetime(splunk, self.splunk_query,
-                                                          self.splunk_args, init_datetime)
-        tz_from_datetime = pytz.utc.localize(splunk_latest_dt)
-        log.info('Init date: %s', str(tz_from_datetime))
+        span = CHECKPOINT_SPAN
+        if self.interval and self.interval.isdigit():
+            span = max(2 * int(self.interval), CHECKPOINT_SPAN)
+        with self.stats.phase('checkpoint_search'):
+            splunk_latest_dt = splunk_utils.get_init_datetime_bounded(
+                splunk, self.splunk_query, self.splunk_args, init_datetime, span)
+        return int((splunk_latest_dt - datetime(1970, 1, 1)).total_seconds())
+
+    def _backfill(self, init_date, source):
+        """ Load journal of source and plan windows up to the final date """
+        tz_to_datetime = self._final_date()
+        backfill = journal.BackfillJournal(self.checkpoint_dir, source).load()
+        rest_from_timestamp = backfill.next_from()
+        if rest_from_timestamp is None:
+            rest_from_timestamp = self._checkpoint_timestamp(init_date, source)
+        tz_from_datetime = pytz.utc.localize(datetime.utcfromtimestamp(rest_from_timestamp))
+        log.info('Init date: %s', str(tz_from_datetime), extra={'source': source})
         if tz_from_datetime <= tz_to_datetime:
             log.info('Getting events in time range: %s', str(tz_from_datetime) \
                  + ' - %s', str(tz_to_datetime))
+            rest_to_timestamp = int((tz_to_datetime - pytz.utc.localize(datetime(1970, 1, 1)))
+                                    .total_seconds())
+            backfill.plan(rest_from_timestamp, rest_to_timestamp, WINDOW_SPAN)
         else:
             log.info('Not grabbing events today')
+        return backfill
+
+    def _reference_cache(self):
+        """ Reference data cache shared by inputs of the process """
+        return ReferenceCache(os.path.join(self.checkpoint_dir, 'reference'))
+
+    def _accounts(self, api, card_id, discover_accounts):
+        """ Get accounts the input fetches, with their sources """
+        if not discover_accounts:
+            account = {'id': card_id, 'source': self.source}
+            if any(getattr(stage, 'needs_account_currency', False)
+                   for stage in self.stages):
+                try:
+                    for info in api.client_info().get('accounts', []):
+                        if info['id'] == card_id:
+                            account['currencyCode'] = info['currencyCode']
+                except Exception:
+                    log.warning('Account currency is unknown', exc_info=True)
+            return [account]
+        client_info = api.client_info()
+        accounts = client_info.get('accounts', []) + client_info.get('jars', [])
+        log.info('Accounts discovered', extra={'accounts': len(accounts)})
+        return [{'id': account['id'], 'source': self.source + '/' + account['id'],
+                 'currencyCode': account.get('currencyCode')} for account in accounts]
+
+    def _stage(self, items, account):
+        """ Pass items through window stages """
+        with self.stats.phase('stages'):
+            for stage in self.stages:
+                items = stage(items, account)
+        return items
+
+    def _serialize(self, items, account):
+        """ Yield items as Splunk events of account source """
+        stats = self.stats
+        encode = self.encoder.encode
+        revise = self.supersessions.revise if self.supersessions is not None else None
+        for item in items:
+            started = time.perf_counter()
+            if revise is not None:
+                revise(item)
+            data = encode(item)
+            stats.add_time('serialize', time.perf_counter() - started)
+            stats.add('bytes_out', len(data))
+            yield modularinput.Event(
+                data=data,
+                index=self.index,
+                source=account['source'],
+                sourcetype=self.sourcetype
+            )
+
+    def _emit(self, items, account):
+        """ Yield staged items as Splunk events, followed by items of
+            previous windows changed by stages and rollups of the touched days
+        """
+        yield from self._serialize(items, account)
+        for stage in self.stages:
+            if hasattr(stage, 'pop_reemits'):
+                for item, item_account in stage.pop_reemits():
+                    yield from self._serialize([item], item_account)
+        if self.rollup is not None:
+            self.rollup.add(items, account['id'])
+            for day_start, record in self.rollup.pop_touched():
+                yield modularinput.Event(
+                    data=json.dumps(record),
+                    time='%.3f' % day_start,
+                    index=self.metrics_index,
+                    source=self.source,
+                    sourcetype=ROLLUP_SOURCETYPE
+                )
+
+    def _events(self, items, account):
+        """ Pass items through window stages and yield them as Splunk events """
+        return self._emit(self._stage(items, account), account)
+
+    def _commit_stages(self):
+        """ Let stages persist their state once events are written """
+        for stage in self.stages:
+            if hasattr(stage, 'commit'):
+                stage.commit()
+        if self.supersessions is not None:
+            self.supersessions.commit()
+        if self.rollup is not None:
+            # emitted values are saved only once their points are written
+            self.rollup.save()
+
+    def monobank(self, init_date, card_id, token, discover_accounts=False,
+                 between_windows=None):
+        """ get Monobank transactions as Splunk events, followed after every
+            window by events of between_windows() if set
+        """
+        api = MonobankAPI(token, cache=self._reference_cache(), stats=self.stats)
+        if self.fx is not None:
+            try:
+                self.fx.update(api.currency())
+            except Exception:
+                log.warning('Currency rates are not updated', exc_info=True)
+        tasks = []
+        revisits = []
+        for account in self._accounts(api, card_id, discover_accounts):
+            backfill = self._backfill(init_date, account['source'])
+            tasks.extend((account, backfill, window)
+                         for window in backfill.incomplete(self.newest_first))
+            if self.revisit_days and backfill.windows:
+                # trailing range before the not emitted windows, fetched again
+                # to catch settled holds and edited transactions
+                revisit_to = backfill.windows[0]['from'] - 1
+                if backfill.windows[0]['state'] == journal.EMITTED:
+                    revisit_to = backfill.windows[0]['to']
+                revisit_from = max(revisit_to - self.revisit_days * 24 * 3600 + 1, 0)
+                revisits.extend((dict(account, revisit=True), None, window) for window in
+                                journal.split(revisit_from, revisit_to, WINDOW_SPAN))
+            if self.balance is not None:
+                for gap in self.balance.open_gaps(account['id']):
+                    windows = journal.split(gap['from'], gap['to'], WINDOW_SPAN)
+                    revisits.extend((dict(account, gap=gap, gap_end=window is windows[-1]),
+                                     None, window) for window in windows)
+        if self.newest_first:
+            # recent windows of all accounts first, then history backwards
+            tasks.sort(key=lambda task: task[2]['from'], reverse=True)
+        elif self.transfers is not None:
+            # same windows of all accounts next to each other, to be grouped
+            tasks.sort(key=lambda task: task[2]['from'])
+        tasks.extend(revisits)
+
+        def statement(account, window):
+            items = api.statement(account['id'], window['from'], window['to'])
+            if self.archive is not None:
+                self.archive.append(account, window, items)
+            return items
+
+        def fetch(task):
+            account, backfill, window = task
+            if backfill is None:
+                return statement(account, window)
+            if window['state'] == journal.PENDING:
+                items = statement(account, window)
+                backfill.mark_fetched(window, items)
+            else:
+                log.info('Resuming fetched window', extra={'window': window})
+                items = backfill.load_items(window)
+            return items
+
+        for group in self._groups(Prefetcher(tasks, fetch, PREFETCH_DEPTH)):
+            # all windows of the group pass stages before any is written, so
+            # stages can relate transactions of different accounts
+            staged = []
+            for task, items in group:
+                # ascending time, so the window is a prefix of the checkpoint order
+                ascending(items)
+                staged.append((task, self._stage(items, task[0])))
+            for task, items in staged:
+                yield from self._emit(items, task[0])
+            # generator is resumed only when all group events are written
+            self._flush()
+            self._commit_stages()
+            for (account, backfill, window), _ in staged:
+                if backfill is None:
+                    log.info('Gap refetched' if 'gap' in account else 'Window revisited',
+                             extra={'source': account['source'], 'window': window})
+                    continue
+                backfill.mark_emitted(window)
+                log.info('Window emitted', extra={'source': account['source'],
+                                                  'window': window,
+                                                  'watermark': backfill.watermark()})
+            if between_windows is not None:
+                # stage state is committed, other events can be interleaved
+                yield from between_windows()
+
+    def _groups(self, fetched):
+        """ Lists of fetched (task, items) written together: with transfer
+            matching consecutive windows of the same range, otherwise one
+        """
+        if self.transfers is None:
+            return ([entry] for entry in fetched)
+        return (list(group) for _, group in
+                groupby(fetched, key=lambda entry: (entry[0][2]['from'], entry[0][2]['to'])))
+
+    def replay(self, init_date):
+        """ Archived statement windows since init date as Splunk events,
+            without API calls. Of transactions archived more than once the
+            most recently fetched version is written. A completed replay is
+            not repeated for the same or a later init date.
+        """
+        from_ts = int((datetime.strptime(init_date, INIT_DATE_FMT) -
+                       datetime(1970, 1, 1)).total_seconds())
+        if self.archive.replayed(from_ts):
+            log.warning('Archive was already replayed since init date, disable replay')
             return
-        rest_from_timestamp = int((splunk_latest_dt - datetime(1970, 1, 1))
-                                .total_seconds())
-        rest_to_timestamp = int((tz_to_datetime - pytz.utc.localize(datetime(1970, 1, 1)))
-                                .total_seconds())
+        seen_ids = set()
+        for entry, items in self.archive.replay(from_ts):
+            items = [item for item in items if item['id'] not in seen_ids]
+            seen_ids.update(item['id'] for item in items)
+            ascending(items)
+            account = {'id': entry['card'], 'source': entry['source'],
+                       'currencyCode': entry.get('currencyCode')}
+            yield from self._events(items, account)
+            self._flush()
+            self._commit_stages()
+            log.info('Window replayed', extra={'source': entry['source'],
+                                               'window': {'from': entry['from'],
+                                                          'to': entry['to']}})
+        # replaying is one-shot, a replay interrupted before is done again
+        self.archive.mark_replayed(from_ts)
+
+    def import_files(self, work_dir, card_id):
+        """ Statement files of <work_dir>/inbound as Splunk events """
+        importer = StatementImporter(work_dir)
+        # imported history spans years, so ids are kept for all time
+        seen = SeenLog(self.checkpoint_dir, self.source + '.import').load()
+        detector = ChangeDetector(seen)
+        account = {'id': card_id, 'source': self.source}
+        for path in importer.files():
+            try:
+                for items in importer.batches(path):
+                    items = detector(items, account)
+                    ascending(items)
+                    yield from self._events(items, account)
+                    self._flush()
+                    self._commit_stages()
+                    detector.commit()
+            except Exception:
+                # a broken file must not stop imports of others and API polling,
+                # items written before the error are dropped on a later import
+                log.exception('Failed to import statement file', extra={'file': path})
+                importer.reject(path)
+                continue
+            importer.archive(path)
+
+    def _webhook_events(self, receiver, accounts, timeout=0):
+        """ Queued webhook items as Splunk events """
+        for account_id, item in receiver.drain(timeout):
+            yield from self._events([item], accounts[account_id])
+            # stage state is committed only once the item's events are written
+            self._flush()
+            self._commit_stages()
+
+    def _write_webhooks(self, receiver, accounts, event_writer, timeout=0):
+        """ Write queued webhook items, returns number of events """
+        event_count = 0
+        for splunk_event in self._webhook_events(receiver, accounts, timeout):
+            event_writer.write_event(splunk_event)
+            event_count += 1
+        return event_count
+
+    def receive(self, input_item, event_writer):
+        """ Long-running webhook mode: write pushed transactions as they come
+            and reconcile with statements every reconcile_interval seconds
+        """
+        token = input_item['token']
+        discover_accounts = is_true(input_item.get('discover_accounts'))
+        api = MonobankAPI(token, cache=self._reference_cache(), stats=self.stats)
+        accounts = {account['id']: account for account in
+                    self._accounts(api, input_item['card_id'], discover_accounts)}
+        webhook_url = input_item.get('webhook_url')
+        receiver = WebhookReceiver(input_item['webhook_listen'],
+                                   urlparse(webhook_url).path if webhook_url else None,
+                                   accounts)
+        receiver.start()
+        if webhook_url:
+            api.set_webhook(webhook_url)
+            log.info('Webhook registered')
+        interval = int(input_item.get('reconcile_interval') or RECONCILE_INTERVAL)
+        next_reconcile = 0
         try:
-            mono = requests.get(REST_URI +
-                                str(card_id) + '/' + str(rest_from_timestamp) + '/' +
-                                str(rest_to_timestamp),
-                                headers={"X-Token":token})
-        except HTTPError:
-            log.exception('Non 2xx HTTP response code received')
-        log.debug('Data received', extra={'data': str(mono.content)})
-        for item in json.loads(mono.text):
-            yield json.dumps(item)
+            while True:
+                if time.monotonic() >= next_reconcile:
+                    event_count = 0
+                    # webhook items are written between windows only, stage state
+                    # must not be committed while a window is partly written
+                    for splunk_event in self.monobank(
+                            input_item['init_date'], input_item['card_id'], token,
+                            discover_accounts,
+                            lambda: self._webhook_events(receiver, accounts)):
+                        event_writer.write_event(splunk_event)
+                        event_count += 1
+                    log.info('Reconciliation complete', extra={'event_count': event_count})
+                    self._write_summary(event_writer, event_count)
+                    self.stats = RunStats()
+                    next_reconcile = time.monotonic() + interval
+                event_count = self._write_webhooks(receiver, accounts, event_writer, timeout=1)
+                if event_count:
+                    log.info('Webhook events written', extra={'event_count': event_count})
+        finally:
+            receiver.stop()
+
+    def _open_spool(self, event_writer):
+        """ Spool drained to event_writer by a background thread """
+        def write(record):
+            event_writer.write_event(modularinput.Event(**record))
+
+        def commit():
+            if self.output is not None:
+                self.output.commit()
+
+        return Spool(self.checkpoint_dir, self.source).open(write, commit)
+
+    def _write_summary(self, event_writer, event_count):
+        """ Log run telemetry and send it to metrics index if configured """
+        summary = self.stats.summary()
+        summary['event_count'] = event_count
+        log.info('Run summary', extra={'summary': summary})
+        if self.metrics_index:
+            record = {'monobank.run.' + name: value for name, value in summary.items()}
+            record['input'] = self.source
+            event_writer.write_event(modularinput.Event(
+                data=json.dumps(record),
+                time='%.3f' % time.time(),
+                index=self.metrics_index,
+                source=self.source,
+                sourcetype=TELEMETRY_SOURCETYPE
+            ))
+        self._flush()
 
     def get_scheme(self):
         """Creates modular input scheme.
@@ -129,6 +528,9 @@ class CostsModularInput(modularinput.Script):
         scheme = modularinput.Scheme(SPLUNK_MI_NAME)
         scheme.description = SPLUNK_MI_DESC
         scheme.use_external_validation = True
+        # a process per input, so a long-running webhook input does not block
+        # the polled ones
+        scheme.use_single_instance = False
 
         card_id = modularinput.Argument('card_id')
         card_id.data_type = modularinput.Argument.data_type_number
@@ -138,7 +540,7 @@ class CostsModularInput(modularinput.Script):
 
         token = modularinput.Argument('token')
         token.data_type = modularinput.Argument.data_type_string
-        token.description = 'Monobank token'
+        token.description = 'Monobank token, moved to storage/passwords on the first run'
         token.required_on_create = True
         scheme.add_argument(token)
 
@@ -148,6 +550,150 @@ class CostsModularInput(modularinput.Script):
         init_date.required_on_create = True
         scheme.add_argument(init_date)
 
+        discover_accounts = modularinput.Argument('discover_accounts')
+        discover_accounts.data_type = modularinput.Argument.data_type_boolean
+        discover_accounts.description = 'Fetch all accounts and jars of the token, card_id is ignored'
+        discover_accounts.required_on_create = False
+        scheme.add_argument(discover_accounts)
+
+        enrich = modularinput.Argument('enrich')
+        enrich.data_type = modularinput.Argument.data_type_boolean
+        enrich.description = 'Add currency codes, amounts in major units and MCC categories'
+        enrich.required_on_create = False
+        scheme.add_argument(enrich)
+
+        normalize_merchants = modularinput.Argument('normalize_merchants')
+        normalize_merchants.data_type = modularinput.Argument.data_type_boolean
+        normalize_merchants.description = 'Add canonical merchant name of description'
+        normalize_merchants.required_on_create = False
+        scheme.add_argument(normalize_merchants)
+
+        category_rules = modularinput.Argument('category_rules')
+        category_rules.data_type = modularinput.Argument.data_type_string
+        category_rules.description = 'Lookup file (or path) of category rules, empty to disable'
+        category_rules.required_on_create = False
+        scheme.add_argument(category_rules)
+
+        base_currency = modularinput.Argument('base_currency')
+        base_currency.data_type = modularinput.Argument.data_type_string
+        base_currency.description = 'Currency of amount_base field (e.g. UAH, EUR), empty to disable'
+        base_currency.required_on_create = False
+        scheme.add_argument(base_currency)
+
+        indexed_fields = modularinput.Argument('indexed_fields')
+        indexed_fields.data_type = modularinput.Argument.data_type_boolean
+        indexed_fields.description = 'Add card and amountBucket fields for index-time extraction'
+        indexed_fields.required_on_create = False
+        scheme.add_argument(indexed_fields)
+
+        balance_check = modularinput.Argument('balance_check')
+        balance_check.data_type = modularinput.Argument.data_type_boolean
+        balance_check.description = 'Detect missing transactions by balance continuity and refetch them'
+        balance_check.required_on_create = False
+        scheme.add_argument(balance_check)
+
+        match_transfers = modularinput.Argument('match_transfers')
+        match_transfers.data_type = modularinput.Argument.data_type_boolean
+        match_transfers.description = 'Tag both legs of transfers between own accounts with transferId'
+        match_transfers.required_on_create = False
+        scheme.add_argument(match_transfers)
+
+        metrics_index = modularinput.Argument('metrics_index')
+        metrics_index.data_type = modularinput.Argument.data_type_string
+        metrics_index.description = 'Metrics index for daily spend rollups, empty to disable'
+        metrics_index.required_on_create = False
+        scheme.add_argument(metrics_index)
+
+        catch_up = modularinput.Argument('catch_up')
+        catch_up.data_type = modularinput.Argument.data_type_string
+        catch_up.description = 'Backfill order (oldest_first|newest_first)'
+        catch_up.required_on_create = False
+        scheme.add_argument(catch_up)
+
+        revisit_days = modularinput.Argument('revisit_days')
+        revisit_days.data_type = modularinput.Argument.data_type_number
+        revisit_days.description = 'Days fetched again every run to ingest changed transactions'
+        revisit_days.required_on_create = False
+        scheme.add_argument(revisit_days)
+
+        webhook_listen = modularinput.Argument('webhook_listen')
+        webhook_listen.data_type = modularinput.Argument.data_type_string
+        webhook_listen.description = 'Run as webhook receiver on [host:]port, empty to poll'
+        webhook_listen.required_on_create = False
+        scheme.add_argument(webhook_listen)
+
+        webhook_url = modularinput.Argument('webhook_url')
+        webhook_url.data_type = modularinput.Argument.data_type_string
+        webhook_url.description = 'Public webhook URL to register in Monobank'
+        webhook_url.required_on_create = False
+        scheme.add_argument(webhook_url)
+
+        reconcile_interval = modularinput.Argument('reconcile_interval')
+        reconcile_interval.data_type = modularinput.Argument.data_type_number
+        reconcile_interval.description = 'Webhook mode statement reconciliation period, seconds'
+        reconcile_interval.required_on_create = False
+        scheme.add_argument(reconcile_interval)
+
+        import_dir = modularinput.Argument('import_dir')
+        import_dir.data_type = modularinput.Argument.data_type_string
+        import_dir.description = 'Directory whose inbound/ statement files are imported'
+        import_dir.required_on_create = False
+        scheme.add_argument(import_dir)
+
+        archive = modularinput.Argument('archive')
+        archive.data_type = modularinput.Argument.data_type_boolean
+        archive.description = 'Keep compressed archive of fetched statement windows'
+        archive.required_on_create = False
+        scheme.add_argument(archive)
+
+        replay = modularinput.Argument('replay')
+        replay.data_type = modularinput.Argument.data_type_boolean
+        replay.description = 'Ingest from archive since init_date instead of Monobank API'
+        replay.required_on_create = False
+        scheme.add_argument(replay)
+
+        spool = modularinput.Argument('spool')
+        spool.data_type = modularinput.Argument.data_type_boolean
+        spool.description = 'Buffer events on disk so that fetching is not blocked by splunkd'
+        spool.required_on_create = False
+        scheme.add_argument(spool)
+
+        compact_json = modularinput.Argument('compact_json')
+        compact_json.data_type = modularinput.Argument.data_type_boolean
+        compact_json.description = 'Write event data without whitespace and escaped unicode'
+        compact_json.required_on_create = False
+        scheme.add_argument(compact_json)
+
+        fields = modularinput.Argument('fields')
+        fields.data_type = modularinput.Argument.data_type_string
+        fields.description = 'Comma separated fields written to events, empty for all'
+        fields.required_on_create = False
+        scheme.add_argument(fields)
+
+        exclude_fields = modularinput.Argument('exclude_fields')
+        exclude_fields.data_type = modularinput.Argument.data_type_string
+        exclude_fields.description = 'Comma separated fields not written to events'
+        exclude_fields.required_on_create = False
+        scheme.add_argument(exclude_fields)
+
+        rename_fields = modularinput.Argument('rename_fields')
+        rename_fields.data_type = modularinput.Argument.data_type_string
+        rename_fields.description = 'Comma separated from:to field renames'
+        rename_fields.required_on_create = False
+        scheme.add_argument(rename_fields)
+
+        omit_empty = modularinput.Argument('omit_empty')
+        omit_empty.data_type = modularinput.Argument.data_type_boolean
+        omit_empty.description = 'Do not write null, empty and zero commission or cashback fields'
+        omit_empty.required_on_create = False
+        scheme.add_argument(omit_empty)
+
+        profile = modularinput.Argument('profile')
+        profile.data_type = modularinput.Argument.data_type_string
+        profile.description = 'Profile runs (cprofile|tracemalloc|sample), empty to disable'
+        profile.required_on_create = False
+        scheme.add_argument(profile)
+
         log_level = modularinput.Argument('log_level')
         log_level.data_type = modularinput.Argument.data_type_string
         log_level.description = 'Log level (DEBUG|INFO)'
@@ -169,35 +715,159 @@ class CostsModularInput(modularinput.Script):
         log_level = str(validation_definition.parameters['log_level'])
         if log_level not in ('INFO', 'DEBUG'):
             log.exception('Incorrect log level format, should be INFO|DEBUG')
+        catch_up = validation_definition.parameters.get('catch_up')
+        if catch_up and catch_up not in CATCH_UP_MODES:
+            log.exception('Incorrect catch up mode, should be oldest_first|newest_first')
+        profile = validation_definition.parameters.get('profile')
+        if profile and profile not in profiling.MODES:
+            log.exception('Incorrect profile mode, should be cprofile|tracemalloc|sample')
+        base_currency = validation_definition.parameters.get('base_currency')
+        if base_currency and base_currency.upper() not in Tables.load().currency_alpha:
+            log.exception('Incorrect base currency, should be ISO 4217 alpha code')
+        rename_fields = validation_definition.parameters.get('rename_fields')
+        if rename_fields and any(':' not in part for part in parse_list(rename_fields)):
+            log.exception('Incorrect field renames, should be from:to[,from:to]')
+
+    def _app_service(self):
+        """ Connection to splunkd in the app context, opened on first use """
+        if self.app_service is None:
+            self.app_service = splunkutils.Splunk().connect(self.mgmt_endpoint,
+                                                            session_key=self.session_key,
+                                                            app=REALM)
+        return self.app_service
+
+    def _token(self, input_name, input_item):
+        """ Token of input from storage/passwords. A plain token found in
+            inputs.conf is stored there and masked in the conf.
+        """
+        kind, _, name = input_name.partition('://')
+        credentials = Credentials(self._app_service())
+        token = input_item['token']
+        if token == MASK:
+            return credentials.get(name)
+        try:
+            credentials.store(name, token)
+            credentials.mask(kind, name)
+        except Exception:
+            # ingestion goes on with the plain token, storing is retried next run
+            log.exception('Failed to store token')
+        return token
+
+    def _stream_input(self, input_name, input_item, event_writer):
+        """Writes events of one input to event_writer."""
+        CustomJsonFormatter.input_name = input_name
+        log.info('Initializing modular input')
+        log.setLevel(input_item['log_level'])
+        if input_item['index'] == 'default':
+            input_item['index'] = 'main'
+        self.index = input_item['index']
+        self.source = input_name
+        self.sourcetype = input_item['sourcetype']
+        self.interval = input_item.get('interval')
+        self.newest_first = input_item.get('catch_up') == 'newest_first'
+        self.revisit_days = int(input_item.get('revisit_days') or 0)
+        self.session_key = self._input_definition.metadata['session_key']
+        self.checkpoint_dir = self._input_definition.metadata['checkpoint_dir']
+        self.mgmt_endpoint = urlparse(
+            self._input_definition.metadata['server_uri'])
+        self.app_service = None
+        input_item['token'] = self._token(input_name, input_item)
+        self.stages = []
+        if is_true(input_item.get('enrich')):
+            self.stages.append(Enricher())
+        if is_true(input_item.get('normalize_merchants')):
+            self.stages.append(MerchantNormalizer())
+        if input_item.get('category_rules'):
+            self.stages.append(Categorizer(
+                os.path.join(LOOKUPS_DIR, input_item['category_rules'])))
+        self.fx = None
+        if input_item.get('base_currency'):
+            self.fx = FxConverter(self.checkpoint_dir, input_item['base_currency']).load()
+            self.stages.append(self.fx)
+        if is_true(input_item.get('indexed_fields')):
+            self.stages.append(IndexedFields())
+        self.balance = None
+        if is_true(input_item.get('balance_check')):
+            self.balance = BalanceCheck(self.checkpoint_dir, self.source).load()
+            self.stages.append(self.balance)
+        self.transfers = None
+        if is_true(input_item.get('match_transfers')):
+            self.transfers = TransferMatcher(self.checkpoint_dir, self.source,
+                                             retention(self.revisit_days)).load()
+            self.stages.append(self.transfers)
+        # versions written again are tagged superseded for reports
+        self.supersessions = Supersessions(self.checkpoint_dir, self.source,
+                                           self._app_service,
+                                           retention(self.revisit_days)).load()
+        self.metrics_index = input_item.get('metrics_index')
+        self.rollup = None
+        if self.metrics_index:
+            self.rollup = DailyRollup(self.checkpoint_dir, self.source).load()
+        self.stats = RunStats()
+        self.encoder = EventEncoder(
+            compact=is_true(input_item.get('compact_json')),
+            fields=parse_list(input_item.get('fields')),
+            exclude_fields=parse_list(input_item.get('exclude_fields')),
+            rename_fields=parse_mapping(input_item.get('rename_fields')),
+            omit_empty=is_true(input_item.get('omit_empty')))
+        replay = is_true(input_item.get('replay'))
+        self.archive = None
+        if is_true(input_item.get('archive')) or replay:
+            self.archive = ResponseArchive(self.checkpoint_dir, self.source)
+        if (input_item.get('webhook_listen') or self.revisit_days) and not replay:
+            # hashes are taken of items as returned by Monobank, before other stages
+            seen = SeenIndex(self.checkpoint_dir, self.source,
+                             retention(self.revisit_days)).load()
+            self.stages.insert(0, ChangeDetector(seen))
+        if input_item.get('webhook_listen') and not replay:
+            self.receive(input_item, event_writer)
+            return
+        if replay:
+            events = self.replay(input_item['init_date'])
+        else:
+            events = self.monobank(input_item['init_date'], input_item['card_id'],
+                                   input_item['token'],
+                                   is_true(input_item.get('discover_accounts')))
+        if input_item.get('import_dir') and not replay:
+            events = chain(self.import_files(input_item['import_dir'],
+                                             input_item['card_id']), events)
+        if is_true(input_item.get('spool')):
+            # window progress is committed once events are durable in the spool,
+            # splunkd backpressure only delays the draining thread
+            self.spool = self._open_spool(event_writer)
+        event_count = 0
+        try:
+            for splunk_event in events:
+                started = time.perf_counter()
+                if self.spool is not None:
+                    self.spool.append({'data': splunk_event.data, 'time': splunk_event.time,
+                                       'index': splunk_event.index,
+                                       'source': splunk_event.source,
+                                       'sourcetype': splunk_event.sourceType})
+                else:
+                    event_writer.write_event(splunk_event)
+                self.stats.add_time('write', time.perf_counter() - started)
+                event_count += 1
+            if self.spool is not None:
+                with self.stats.phase('spool_drain'):
+                    self.spool.close()
+        except Exception:
+            if self.spool is not None:
+                # events of the interrupted window are fetched again next run
+                self.spool.close(commit=False)
+            raise
+        finally:
+            self.spool = None
+        log.info('Ingestion to Splunk complete', extra={'event_count': event_count})
+        self._write_summary(event_writer, event_count)
 
     def stream_events(self, inputs, event_writer):
         """Writes event objects to event_writer."""
         try:
             for input_name, input_item in inputs.inputs.items():
-                CustomJsonFormatter.input_name = input_name
-                log.info('Initializing modular input')
-                log.setLevel(input_item['log_level'])
-                if input_item['index'] == 'default':
-                    input_item['index'] = 'main'
-                else:
-                    self.index = input_item['index']
-                self.source = input_name
-                self.sourcetype = input_item['sourcetype']
-                self.session_key = self._input_definition.metadata['session_key']
-                self.mgmt_endpoint = urlparse(
-                    self._input_definition.metadata['server_uri'])
-                event_count = 0
-                for item in self.monobank(
-                        input_item['init_date'], input_item['card_id'],
-                        input_item['token']):
-                    splunk_event = modularinput.Event(
-                        data=item,
-                        index=input_item['index'],
-                        sourcetype=input_item['sourcetype']
-                    )
-                    event_writer.write_event(splunk_event)
-                    event_count += 1
-                log.info('Ingestion to Splunk complete', extra={'event_count': event_count})
+                with profiling.Profiler(input_item.get('profile'), PROFILE_DIR,
+                                        journal.safe_name(input_name)):
+                    self._stream_input(input_name, input_item, event_writer)
         except Exception as exception:
             log.exception(exception)
             raise
@@ -215,6 +885,9 @@ if __name__ == '__main__':
     log.setLevel(logging.INFO)
 
     try:
-        sys.exit(CostsModularInput().run(sys.argv))
+        # profiling of the whole run, including input definition parsing
+        with profiling.Profiler(os.environ.get(profiling.PROFILE_ENV), PROFILE_DIR):
+            exit_code = CostsModularInput().run(sys.argv)
+        sys.exit(exit_code)
     except Exception as exception:
         log.exception(str(exception))
@@ -0,0 +1,112 @@
+""" Compressed append-only archive of statement responses """
+
+import os
+import gzip
+import json
+import mmap
+import threading
+from myutils.journal import safe_name
+
+
+class ResponseArchive:
+    """ Every fetched statement window is appended to <name>.archive.gz as a
+        separate gzip member (the file is readable with zcat) and indexed by
+        (card, from, to) in <name>.archive.idx, one JSON line per window.
+        Index lines are written after data, so a crash leaves at most
+        unreferenced bytes and an incomplete last index line, which is cut
+        before the next append. A completed replay is recorded in
+        <name>.archive.replayed.
+    """
+
+    def __init__(self, checkpoint_dir, name):
+        base = os.path.join(checkpoint_dir, safe_name(name) + '.archive')
+        self.data_path = base + '.gz'
+        self.index_path = base + '.idx'
+        self.replayed_path = base + '.replayed'
+        # windows are archived by the fetching thread
+        self.lock = threading.Lock()
+        self.repaired = False
+
+    def _repair_index(self):
+        """ Truncates incomplete last line of interrupted index write """
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'rb+') as file:
+            size = file.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(end - 4096, 0)
+                file.seek(start)
+                newline = file.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                file.truncate(end)
+
+    def append(self, account, window, items):
+        """ Archives items of statement window of account """
+        data = gzip.compress(json.dumps(items, separators=(',', ':')).encode('utf-8'))
+        with self.lock:
+            with open(self.data_path, 'ab') as file:
+                offset = file.tell()
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            if not self.repaired:
+                self._repair_index()
+                self.repaired = True
+            entry = {'card': account['id'], 'source': account['source'],
+                     'currencyCode': account.get('currencyCode'),
+                     'from': window['from'], 'to': window['to'],
+                     'offset': offset, 'length': len(data), 'rows': len(items)}
+            with open(self.index_path, 'a') as file:
+                file.write(json.dumps(entry) + '\n')
+
+    def entries(self, from_ts=0):
+        """ Index entries of windows ending after from_ts in archive order,
+            of a (card, from, to) window archived more than once only the
+            latest copy is kept
+        """
+        if not os.path.exists(self.index_path):
+            return []
+        entries = {}
+        with open(self.index_path, 'r') as file:
+            for line in file:
+                if not line.endswith('\n'):
+                    # incomplete last line of interrupted write
+                    break
+                entry = json.loads(line)
+                if entry['to'] >= from_ts:
+                    key = (entry['card'], entry['from'], entry['to'])
+                    entries.pop(key, None)
+                    entries[key] = entry
+        return list(entries.values())
+
+    def replay(self, from_ts=0):
+        """ Yields (entry, items) of archived windows, most recently fetched
+            first, reading the memory mapped archive without loading it whole
+        """
+        entries = self.entries(from_ts)
+        if not entries:
+            return
+        with open(self.data_path, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for entry in reversed(entries):
+                    member = data[entry['offset']:entry['offset'] + entry['length']]
+                    yield entry, json.loads(gzip.decompress(member))
+
+    def replayed(self, from_ts):
+        """ Whether archive was already replayed since from_ts or earlier """
+        if not os.path.exists(self.replayed_path):
+            return False
+        with open(self.replayed_path, 'r') as file:
+            return json.load(file)['from'] <= from_ts
+
+    def mark_replayed(self, from_ts):
+        """ Atomically records completed replay since from_ts """
+        tmp_path = self.replayed_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'from': from_ts}, file)
+        os.replace(tmp_path, self.replayed_path)
@@ -0,0 +1,120 @@
+""" Detection of missing transactions by running balance continuity """
+
+import os
+import json
+import logging
+from myutils.journal import safe_name
+
+
+log = logging.getLogger(__name__)
+
+
+class BalanceCheck:
+    """ Window stage checking previous balance + amount == balance over
+        consecutive ingested transactions of every account. The last
+        transaction (tail) of every account is persisted. A break flags the
+        transaction with balanceGap = true and records the time range between
+        the two transactions as a gap, which is fetched again once. Items must
+        come in ascending time, transactions of the same second are ordered by
+        balance continuity; older items (newest first catch-up, imports) and
+        updated ones are not checked.
+    """
+
+    def __init__(self, checkpoint_dir, name):
+        self.path = os.path.join(checkpoint_dir, safe_name(name) + '.balance.json')
+        self.tails = {}
+        self.gaps = {}
+        self.changed = False
+
+    def load(self):
+        """ Reads tails and open gaps from disk """
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                state = json.load(file)
+            self.tails = state['tails']
+            self.gaps = state['gaps']
+        return self
+
+    def commit(self):
+        """ Atomically writes state once the window is written """
+        if not self.changed:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'tails': self.tails, 'gaps': self.gaps}, file)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+    def open_gaps(self, account_id):
+        """ Gaps of account to fetch again """
+        gaps = self.gaps.get(account_id, [])
+        for gap in gaps:
+            gap['filled'] = 0
+        return list(gaps)
+
+    def __call__(self, items, account):
+        if account.get('revisit'):
+            return items
+        gap = account.get('gap')
+        if gap is not None:
+            self._fill(gap, items, account['id'], account['gap_end'])
+            return items
+        tail = self.tails.get(account['id'])
+        self._chain(items, tail['balance'] if tail is not None else None)
+        for item in items:
+            if item.get('updated'):
+                continue
+            if tail is not None:
+                if item['time'] < tail['time'] or item['id'] == tail['id']:
+                    continue
+                if tail['balance'] + item['amount'] != item['balance']:
+                    self._gap(account['id'], tail, item)
+            tail = {'id': item['id'], 'time': item['time'], 'balance': item['balance']}
+            self.tails[account['id']] = tail
+            self.changed = True
+        return items
+
+    @staticmethod
+    def _chain(items, balance):
+        """ Reorders runs of transactions in the same second so that every
+            one starts from the balance of the previous one
+        """
+        start = 0
+        while start < len(items):
+            end = start + 1
+            while end < len(items) and items[end]['time'] == items[start]['time']:
+                end += 1
+            if end - start > 1:
+                run = items[start:end]
+                for index in range(start, end):
+                    item = next((item for item in run
+                                 if item['balance'] - item['amount'] == balance), run[0])
+                    run.remove(item)
+                    items[index] = item
+                    balance = item['balance']
+            balance = items[end - 1]['balance']
+            start = end
+
+    def _gap(self, account_id, tail, item):
+        item['balanceGap'] = True
+        gap = {'from': tail['time'] + 1, 'to': item['time'] - 1, 'balance': tail['balance'],
+               'expected': item['balance'] - item['amount'], 'filled': 0}
+        log.warning('Balance gap', extra={'account': account_id, 'gap': gap,
+                                          'id': item['id']})
+        # transactions in the same second can not be fetched separately
+        if gap['from'] <= gap['to']:
+            self.gaps.setdefault(account_id, []).append(gap)
+
+    def _fill(self, gap, items, account_id, gap_end):
+        """ Accounts refetched part of gap, the gap is closed with its last part """
+        gap['filled'] += sum(item['amount'] for item in items)
+        if not gap_end:
+            return
+        if gap['balance'] + gap['filled'] != gap['expected']:
+            log.warning('Balance gap not resolved', extra={'account': account_id,
+                                                           'gap': gap})
+        gaps = self.gaps.get(account_id, [])
+        gaps[:] = [entry for entry in gaps if entry['from'] != gap['from']]
+        if not gaps:
+            self.gaps.pop(account_id, None)
+        self.changed = True
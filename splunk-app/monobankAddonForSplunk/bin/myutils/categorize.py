@@ -0,0 +1,157 @@
+""" Rule-based categorization of transactions """
+
+import os
+import re
+import csv
+import logging
+from operator import itemgetter
+from collections import defaultdict
+
+
+RULES_FILE = 'category_rules.csv'
+MCC_CODES = 10000
+
+log = logging.getLogger(__name__)
+
+
+def overlap(first, second):
+    """ Whether occurrences of the strings can overlap in some text """
+    if first in second or second in first:
+        return True
+    return any(first[-size:] == second[:size] or second[-size:] == first[:size]
+               for size in range(1, min(len(first), len(second))))
+
+
+class Rule:
+    """ Category rule, every non-empty condition must hold """
+
+    def __init__(self, row):
+        self.category = row['category']
+        self.description = row['description'].lower() if row.get('description') else None
+        self.regex = re.compile(row['regex'], re.IGNORECASE | re.DOTALL) \
+            if row.get('regex') else None
+        self.mcc_from = int(row['mcc_from']) if row.get('mcc_from') else None
+        self.mcc_to = int(row['mcc_to']) if row.get('mcc_to') else self.mcc_from
+        self.amount_min = float(row['amount_min']) if row.get('amount_min') else None
+        self.amount_max = float(row['amount_max']) if row.get('amount_max') else None
+
+    def mcc_matches(self, mcc):
+        return self.mcc_from is None or self.mcc_from <= mcc <= self.mcc_to
+
+    def amount_matches(self, amount):
+        return (self.amount_min is None or amount >= self.amount_min) and \
+               (self.amount_max is None or amount <= self.amount_max)
+
+
+class Matcher:
+    """ Rules applicable to one MCC. Description substrings of all rules are
+        found in one scan of the lowercased description by an alternation
+        without groups (named groups disable the alternation optimizations
+        of re), the matched text is the substring. Substrings hidden by an
+        overlapping match are checked separately. Rules of the found
+        substrings and rules without one are then tried in file order.
+    """
+
+    def __init__(self, rules):
+        self.unconditional = []
+        self.rules = defaultdict(list)
+        for number, rule in enumerate(rules):
+            if rule.description is None:
+                self.unconditional.append((number, rule))
+            else:
+                self.rules[rule.description].append((number, rule))
+        # longest first, so substrings of others are not hidden by them
+        substrings = sorted(self.rules, key=len, reverse=True)
+        self.regex = re.compile('|'.join(map(re.escape, substrings)), re.DOTALL) \
+            if substrings else None
+        self.overlaps = {}
+
+    def _overlapping(self, substring):
+        overlapping = self.overlaps.get(substring)
+        if overlapping is None:
+            overlapping = self.overlaps[substring] = [
+                other for other in self.rules if other != substring and overlap(substring, other)]
+        return overlapping
+
+    def _found(self, description):
+        found = {match.group() for match in self.regex.finditer(description)}
+        for substring in list(found):
+            for other in self._overlapping(substring):
+                if other not in found and other in description:
+                    found.add(other)
+        return found
+
+    def category(self, description, amount):
+        """ Category of the first matching rule, None if there is none """
+        candidates = self.unconditional
+        if self.regex is not None:
+            found = self._found(description.lower())
+            if found:
+                candidates = sorted(candidates + [entry for substring in found
+                                                  for entry in self.rules[substring]],
+                                    key=itemgetter(0))
+        for _, rule in candidates:
+            if not rule.amount_matches(amount):
+                continue
+            if rule.regex is not None and rule.regex.search(description) is None:
+                continue
+            return rule.category
+        return None
+
+
+class Categorizer:
+    """ Window stage adding category of the first matching rule of the
+        rules file. Matchers are built per MCC on first use and the file is
+        loaded again only when its modification time changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.unreadable = False
+        self.rules = []
+        self.matchers = [None] * MCC_CODES
+
+    def _reload(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self.mtime:
+                return
+            with open(self.path, 'r', encoding='utf-8-sig', newline='') as file:
+                rows = list(csv.DictReader(file))
+        except OSError as exception:
+            # e.g. the file is being replaced, warned once until it is readable
+            if not self.unreadable:
+                log.warning('Category rules not readable, previous rules are kept',
+                            extra={'path': self.path, 'reason': str(exception)})
+                self.unreadable = True
+            return
+        self.unreadable = False
+        self.mtime = mtime
+        try:
+            rules = [Rule(row) for row in rows if row.get('category')]
+        except (ValueError, re.error):
+            log.exception('Invalid category rules, previous rules are kept')
+            return
+        self.rules = rules
+        self.matchers = [None] * MCC_CODES
+        log.info('Category rules loaded', extra={'path': self.path, 'rules': len(rules)})
+
+    def _matcher(self, mcc):
+        matcher = self.matchers[mcc]
+        if matcher is None:
+            matcher = self.matchers[mcc] = Matcher([rule for rule in self.rules
+                                                    if rule.mcc_matches(mcc)])
+        return matcher
+
+    def __call__(self, items, account):
+        self._reload()
+        for item in items:
+            mcc = item.get('mcc')
+            if mcc is None or not 0 <= mcc < MCC_CODES:
+                mcc = 0
+            category = self._matcher(mcc).category(item.get('description') or '',
+                                                   item['amount'] / 100)
+            if category is not None:
+                item['category'] = category
+        return items
@@ -0,0 +1,51 @@
+""" Monobank tokens kept in Splunk storage/passwords """
+
+import logging
+
+
+REALM = 'monobankAddonForSplunk'
+# value of token parameter once the token is stored
+MASK = '********'
+
+log = logging.getLogger(__name__)
+
+
+class Credentials:
+    """ Tokens of inputs in storage/passwords, realm REALM and input name as
+        username. All passwords of the realm are read with one list call per
+        process and kept in memory.
+    """
+    # {username: clear password}, shared by inputs of the process
+    _tokens = None
+
+    def __init__(self, service):
+        self.service = service
+
+    def _load(self):
+        if Credentials._tokens is None:
+            Credentials._tokens = {password.username: password.clear_password
+                                   for password in self.service.storage_passwords.list(count=-1)
+                                   if password.realm == REALM}
+        return Credentials._tokens
+
+    def get(self, name):
+        """ Stored token of input, raises KeyError if there is none """
+        tokens = self._load()
+        if name not in tokens:
+            raise KeyError('Token of input %s is not stored, set it again' % name)
+        return tokens[name]
+
+    def store(self, name, token):
+        """ Stores token of input, replacing the previous one """
+        tokens = self._load()
+        passwords = self.service.storage_passwords
+        if name in tokens:
+            passwords.delete(name, REALM)
+        passwords.create(token, name, REALM)
+        tokens[name] = token
+        log.info('Token stored', extra={'input': name})
+
+    def mask(self, kind, name):
+        """ Replaces token in inputs.conf by MASK """
+        self.service.inputs[name, kind].update(token=MASK)
+        log.info('Token masked', extra={'input': name})
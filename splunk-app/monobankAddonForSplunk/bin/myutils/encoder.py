@@ -0,0 +1,56 @@
+""" Event data encoder with field projection """
+
+import json
+
+
+# values of statement fields which carry no information
+DEFAULTS = {'commissionRate': 0, 'cashbackAmount': 0}
+EMPTY = (None, '')
+
+
+def parse_list(value):
+    """ Parse comma separated input parameter """
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+def parse_mapping(value):
+    """ Parse comma separated from:to pairs """
+    return dict(part.split(':', 1) for part in parse_list(value))
+
+
+class EventEncoder:
+    """ Serializes items to JSON event data. Built once per input:
+        compact separators and UTF-8 output, allow/deny list of fields,
+        omission of empty and default values and field renaming.
+        Without options it is equal to json.dumps.
+    """
+
+    def __init__(self, compact=False, fields=None, exclude_fields=None, rename_fields=None,
+                 omit_empty=False):
+        if compact:
+            self._encode = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+        else:
+            self._encode = json.JSONEncoder().encode
+        self.fields = frozenset(fields) if fields else None
+        self.exclude_fields = frozenset(exclude_fields or ())
+        self.rename_fields = dict(rename_fields or {})
+        self.omit_empty = omit_empty
+        self.project = bool(self.fields or self.exclude_fields or self.rename_fields or
+                            omit_empty)
+
+    def _keep(self, name, value):
+        if self.fields is not None and name not in self.fields:
+            return False
+        if name in self.exclude_fields:
+            return False
+        if self.omit_empty and (value in EMPTY or DEFAULTS.get(name, EMPTY) == value):
+            return False
+        return True
+
+    def encode(self, item):
+        """ JSON event data of item """
+        if not self.project:
+            return self._encode(item)
+        rename = self.rename_fields
+        return self._encode({rename.get(name, name): value for name, value in item.items()
+                             if self._keep(name, value)})
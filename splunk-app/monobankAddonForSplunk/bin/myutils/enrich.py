@@ -0,0 +1,79 @@
+""" Ingest-time enrichment of statement items with currency and MCC data """
+
+import os
+import csv
+
+
+LOOKUPS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                           '..', '..', 'lookups')
+CURRENCY_FILE = 'iso4217.csv'
+MCC_FILE = 'mcc_categories.csv'
+
+
+class Tables:
+    """ Code indexed tables, loaded once per process """
+    currency_alpha = None
+    currency_scale = None
+    mcc_category = None
+
+    @classmethod
+    def load(cls):
+        """ Reads lookup files into lists indexed by numeric code """
+        if cls.mcc_category is not None:
+            return cls
+        currency_alpha = [None] * 1000
+        currency_scale = [None] * 1000
+        with open(os.path.join(LOOKUPS_DIR, CURRENCY_FILE), 'r') as file:
+            for row in csv.DictReader(file):
+                code = int(row['code'])
+                currency_alpha[code] = row['alpha']
+                currency_scale[code] = 10 ** int(row['minor_units'])
+        mcc_category = [None] * 10000
+        # rows are ordered from ranges to specific codes, later rows win
+        with open(os.path.join(LOOKUPS_DIR, MCC_FILE), 'r') as file:
+            for row in csv.DictReader(file):
+                category = row['category']
+                for mcc in range(int(row['mcc_from']), int(row['mcc_to']) + 1):
+                    mcc_category[mcc] = category
+        cls.currency_alpha = currency_alpha
+        cls.currency_scale = currency_scale
+        cls.mcc_category = mcc_category
+        return cls
+
+
+class Enricher:
+    """ Adds currency alpha codes, amounts in major units and
+        MCC category names to statement items
+    """
+    needs_account_currency = True
+
+    def __init__(self):
+        tables = Tables.load()
+        self.currency_alpha = tables.currency_alpha
+        self.currency_scale = tables.currency_scale
+        self.mcc_category = tables.mcc_category
+
+    def __call__(self, items, account):
+        account_currency = account.get('currencyCode')
+        currency_alpha = self.currency_alpha
+        currency_scale = self.currency_scale
+        mcc_category = self.mcc_category
+        account_alpha = None
+        account_scale = None
+        # unknown account currency leaves account fields unset
+        if isinstance(account_currency, int) and 0 <= account_currency < 1000:
+            account_alpha = currency_alpha[account_currency]
+            account_scale = currency_scale[account_currency]
+        for item in items:
+            code = item.get('currencyCode')
+            if code is not None and 0 <= code < 1000 and currency_scale[code] is not None:
+                item['currency'] = currency_alpha[code]
+                item['operationAmountValue'] = item['operationAmount'] / currency_scale[code]
+            mcc = item.get('mcc')
+            if mcc is not None and 0 <= mcc < 10000:
+                item['mccCategory'] = mcc_category[mcc]
+            if account_scale is not None:
+                item['accountCurrency'] = account_alpha
+                item['amountValue'] = item['amount'] / account_scale
+                item['balanceValue'] = item['balance'] / account_scale
+        return items
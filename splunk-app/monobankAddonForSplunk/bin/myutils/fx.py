@@ -0,0 +1,104 @@
+""" Ingest-time conversion of amounts to a base currency """
+
+import os
+import json
+import bisect
+import logging
+from datetime import datetime
+import pytz
+from myutils.enrich import Tables
+
+
+UAH = 980
+TZ = pytz.timezone('Europe/Kiev')
+
+log = logging.getLogger(__name__)
+
+
+def day_of(timestamp):
+    """ Kyiv calendar day of timestamp """
+    return datetime.fromtimestamp(timestamp, TZ).strftime('%Y-%m-%d')
+
+
+def uah_rates(snapshot):
+    """ {currency code: UAH per unit} of /bank/currency response """
+    rates = {}
+    for rate in snapshot:
+        if rate.get('currencyCodeB') != UAH:
+            continue
+        if rate.get('rateCross'):
+            rates[rate['currencyCodeA']] = rate['rateCross']
+        elif rate.get('rateBuy') and rate.get('rateSell'):
+            rates[rate['currencyCodeA']] = (rate['rateBuy'] + rate['rateSell']) / 2
+    return rates
+
+
+class FxConverter:
+    """ Window stage adding amount_base, operationAmount in major units of the
+        base currency. Rates come from a per day table of /bank/currency
+        snapshots kept on disk; a day without snapshot uses the closest
+        earlier one (the earliest one for older history). An unknown base
+        currency disables conversion.
+    """
+
+    def __init__(self, checkpoint_dir, base_currency):
+        self.path = os.path.join(checkpoint_dir, 'fx_rates.json')
+        tables = Tables.load()
+        self.currency_scale = tables.currency_scale
+        try:
+            self.base = tables.currency_alpha.index(base_currency.strip().upper())
+        except ValueError:
+            # validate_input only logs, so an unknown currency reaches the run
+            log.error('Unknown base currency, amount_base is not added',
+                      extra={'base_currency': base_currency})
+            self.base = None
+        self.rates = {}
+        self.days = []
+
+    def load(self):
+        """ Reads rate table from disk """
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                self.rates = {day: {int(code): rate for code, rate in rates.items()}
+                              for day, rates in json.load(file).items()}
+        self.days = sorted(self.rates)
+        return self
+
+    def update(self, snapshot):
+        """ Records currency rates snapshot as rates of today """
+        rates = uah_rates(snapshot)
+        if not rates:
+            return
+        rates[UAH] = 1
+        self.rates[day_of(max(rate.get('date', 0) for rate in snapshot))] = rates
+        self.days = sorted(self.rates)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.rates, file)
+        os.replace(tmp_path, self.path)
+
+    def _day_rates(self, day):
+        position = bisect.bisect_right(self.days, day)
+        return self.rates[self.days[max(position - 1, 0)]]
+
+    def __call__(self, items, account):
+        if not self.days or self.base is None:
+            return items
+        # one rate table lookup per day and currency of the window
+        factors = {}
+        scale = self.currency_scale
+        for item in items:
+            code = item.get('currencyCode')
+            if code is None or not 0 <= code < 1000 or scale[code] is None:
+                continue
+            key = (day_of(item['time']), code)
+            factor = factors.get(key)
+            if factor is None:
+                rates = self._day_rates(key[0])
+                if code not in rates or self.base not in rates:
+                    factor = factors[key] = 0
+                else:
+                    factor = factors[key] = rates[code] / rates[self.base] / scale[code]
+            if factor:
+                item['amount_base'] = round(item['operationAmount'] * factor, 2)
+        return items
@@ -0,0 +1,183 @@
+""" Import of statement files dropped to the inbound directory """
+
+import os
+import csv
+import json
+import time
+import logging
+from decimal import Decimal, InvalidOperation
+from datetime import datetime
+import pytz
+from myutils.splunkutils import ModularInput
+from myutils.enrich import Tables
+from myutils.seen import content_hash
+
+
+CHUNK_SIZE = 64 * 1024
+# imported items are passed to stages and written in batches of this size
+BATCH_SIZE = 1000
+EXTENSIONS = ('.csv', '.json', '.jsonl')
+TZ = pytz.timezone('Europe/Kiev')
+CSV_TIME_FMT = '%d.%m.%Y %H:%M:%S'
+# columns of statement exported from the Monobank app, header is localized
+CSV_COLUMNS = ('time', 'description', 'mcc', 'amount', 'operationAmount', 'currency',
+               'exchangeRate', 'commissionRate', 'cashbackAmount', 'balance')
+# exports leave commission and cashback without value as a dash
+EMPTY_AMOUNTS = ('', '-', '\u2013', '\u2014')
+API_INT_FIELDS = ('time', 'mcc', 'originalMcc', 'amount', 'operationAmount', 'currencyCode',
+                  'commissionRate', 'cashbackAmount', 'balance')
+
+log = logging.getLogger(__name__)
+
+
+def iter_json(file):
+    """ Yields objects of JSON arrays (API responses), concatenated arrays
+        or JSON lines, reading the file in chunks
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,[]')
+        if buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                buffer = buffer[end:]
+                yield item
+                continue
+        elif eof:
+            return
+        chunk = file.read(CHUNK_SIZE)
+        eof = not chunk
+        buffer += chunk
+
+
+def minor_units(value):
+    """ Amount in minor units of exported value, e.g. -1 234,50 -> -123450,
+        empty or dash -> 0. Raises ValueError for other values.
+    """
+    value = value.replace('\xa0', '').replace(' ', '').replace(',', '.')
+    if value in EMPTY_AMOUNTS:
+        return 0
+    try:
+        return int(Decimal(value) * 100)
+    except InvalidOperation:
+        raise ValueError('Invalid amount %r' % value)
+
+
+class StatementImporter:
+    """ Parses Monobank statement files from <work_dir>/inbound: CSV exports
+        of the app, CSV with API field names and JSON dumps of API responses.
+        Rows which can not be parsed are skipped. Processed files are moved
+        to inbound/archive, files which can not be read to inbound/rejected.
+    """
+
+    def __init__(self, work_dir):
+        self.inbound_dir, _, _, self.archive_dir, _ = ModularInput().create_dirs(work_dir)
+        self.rejected_dir = os.path.join(self.inbound_dir, 'rejected')
+        alpha = Tables.load().currency_alpha
+        self.currency_code = {name: code for code, name in enumerate(alpha) if name}
+
+    def files(self):
+        """ Statement files in inbound directory, oldest first """
+        paths = [os.path.join(self.inbound_dir, name) for name in os.listdir(self.inbound_dir)
+                 if name.lower().endswith(EXTENSIONS)]
+        return sorted((path for path in paths if os.path.isfile(path)), key=os.path.getmtime)
+
+    def items(self, path):
+        """ Yields statement items of file """
+        with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+            if path.lower().endswith('.csv'):
+                yield from self._csv_items(file)
+            else:
+                for item in iter_json(file):
+                    if isinstance(item, dict) and item.get('id') and \
+                            isinstance(item.get('time'), int) and \
+                            isinstance(item.get('amount'), int):
+                        yield item
+                    else:
+                        log.warning('Skipped statement item', extra={'file': path})
+
+    def _csv_items(self, file):
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            return
+        parse = self._api_row if 'id' in header and 'time' in header else self._export_row
+        for row in reader:
+            try:
+                item = parse(header, row)
+            except (ValueError, TypeError, KeyError) as exception:
+                # e.g. a total line at the end of an export
+                log.warning('Skipped statement row', extra={'line': reader.line_num,
+                                                            'reason': str(exception)})
+                continue
+            if item is not None:
+                yield item
+
+    @staticmethod
+    def _api_row(header, row):
+        item = dict(zip(header, row))
+        for field in API_INT_FIELDS:
+            if item.get(field):
+                item[field] = int(item[field])
+        if not item.get('id') or not isinstance(item.get('time'), int) or \
+                not isinstance(item.get('amount'), int):
+            raise ValueError('Missing id, time or amount')
+        item['hold'] = item.get('hold', '').lower() == 'true'
+        return item
+
+    def _export_row(self, header, row):
+        if not any(row):
+            return None
+        if len(row) < len(CSV_COLUMNS):
+            raise ValueError('Expected %d columns' % len(CSV_COLUMNS))
+        row = dict(zip(CSV_COLUMNS, row))
+        item = {
+            'time': int(TZ.localize(datetime.strptime(row['time'], CSV_TIME_FMT))
+                        .timestamp()),
+            'description': row['description'],
+            'mcc': int(row['mcc']),
+            'hold': False,
+            'amount': minor_units(row['amount']),
+            'operationAmount': minor_units(row['operationAmount']),
+            'currencyCode': self.currency_code.get(row['currency'].strip()),
+            'commissionRate': minor_units(row['commissionRate']),
+            'cashbackAmount': minor_units(row['cashbackAmount']),
+            'balance': minor_units(row['balance'])
+        }
+        # exports have no transaction id
+        item['id'] = content_hash(item)
+        return item
+
+    def batches(self, path):
+        """ Yields lists of at most BATCH_SIZE items of file """
+        batch = []
+        for item in self.items(path):
+            batch.append(item)
+            if len(batch) >= BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def archive(self, path):
+        """ Moves processed file to archive directory """
+        name = os.path.basename(path)
+        target = os.path.join(self.archive_dir, name)
+        if os.path.exists(target):
+            target = os.path.join(self.archive_dir, '%d-%s' % (time.time(), name))
+        os.replace(path, target)
+        log.info('Statement file imported', extra={'file': name})
+
+    def reject(self, path):
+        """ Moves file which can not be read to rejected directory """
+        if not os.path.exists(self.rejected_dir):
+            os.makedirs(self.rejected_dir)
+        name = os.path.basename(path)
+        os.replace(path, os.path.join(self.rejected_dir, '%d-%s' % (time.time(), name)))
+        log.warning('Statement file rejected', extra={'file': name})
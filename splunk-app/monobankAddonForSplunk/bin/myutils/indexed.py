@@ -0,0 +1,26 @@
+""" Fields extracted at index time by the monobank:transaction sourcetype """
+
+
+def amount_bucket(amount):
+    """ Signed power of ten of amount in major units: 4235 -> 10,
+        -150000 -> -1000, amounts below one major unit -> 0
+    """
+    major = abs(amount) // 100
+    if not major:
+        return 0
+    bucket = 10 ** (len(str(major)) - 1)
+    return bucket if amount > 0 else -bucket
+
+
+class IndexedFields:
+    """ Adds card id and amount bucket, which are written as index-time
+        fields mono_* together with mcc, currencyCode and hold, so that
+        per-card and per-MCC aggregations can run with tstats
+    """
+
+    def __call__(self, items, account):
+        card = account['id']
+        for item in items:
+            item['card'] = card
+            item['amountBucket'] = amount_bucket(item['amount'])
+        return items
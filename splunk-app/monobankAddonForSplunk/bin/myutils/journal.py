@@ -0,0 +1,126 @@
+""" Backfill journal: progress of statement windows of a modular input """
+
+import os
+import re
+import json
+import threading
+
+
+PENDING = 'pending'
+FETCHED = 'fetched'
+EMITTED = 'emitted'
+
+
+def safe_name(name):
+    """ Make file name out of input name like monobankAPImi://card """
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+def split(from_ts, to_ts, span):
+    """ Pending windows of max span seconds covering [from_ts, to_ts] """
+    windows = []
+    while from_ts <= to_ts:
+        window_to = min(from_ts + span - 1, to_ts)
+        windows.append({'from': from_ts, 'to': window_to, 'state': PENDING,
+                        'rows': None, 'max_time': None})
+        from_ts = window_to + 1
+    return windows
+
+
+class BackfillJournal:
+    """ Keeps state of every planned window (pending, fetched, emitted).
+        Fetched windows are stored on disk until emitted, so a restart
+        resumes at the first incomplete window without repeating API calls.
+        Windows may be emitted in any order: only the emitted prefix is
+        forgotten.
+    """
+
+    def __init__(self, checkpoint_dir, name):
+        self.path = os.path.join(checkpoint_dir, safe_name(name) + '.journal.json')
+        self.data_dir = os.path.join(checkpoint_dir, safe_name(name) + '.windows')
+        self.windows = []
+        # windows are fetched and emitted by different threads
+        self.lock = threading.RLock()
+
+    def load(self):
+        """ Reads journal from disk """
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                self.windows = json.load(file)['windows']
+        return self
+
+    def save(self):
+        """ Atomically writes journal to disk """
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump({'watermark': self.watermark(), 'windows': self.windows}, file)
+            os.replace(tmp_path, self.path)
+
+    def next_from(self):
+        """ Start of the range which is not planned yet, None for empty journal """
+        if not self.windows:
+            return None
+        return self.windows[-1]['to'] + 1
+
+    def watermark(self):
+        """ End of the range emitted without gaps, None if nothing is emitted """
+        watermark = None
+        for window in self.windows:
+            if window['state'] != EMITTED:
+                break
+            watermark = window['to']
+        return watermark
+
+    def plan(self, from_ts, to_ts, span):
+        """ Splits [from_ts, to_ts] into windows of max span seconds """
+        self.windows.extend(split(from_ts, to_ts, span))
+        self.save()
+
+    def incomplete(self, newest_first=False):
+        """ Windows which are not emitted yet, in planned or reversed order """
+        windows = [window for window in self.windows if window['state'] != EMITTED]
+        if newest_first:
+            windows.reverse()
+        return windows
+
+    def _data_path(self, window):
+        return os.path.join(self.data_dir, '%d-%d.json' % (window['from'], window['to']))
+
+    def mark_fetched(self, window, items):
+        """ Stores fetched window items and moves window to fetched state """
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        with open(self._data_path(window), 'w') as file:
+            json.dump(items, file)
+        with self.lock:
+            window['state'] = FETCHED
+            window['rows'] = len(items)
+            window['max_time'] = max((item['time'] for item in items), default=None)
+            self.save()
+
+    def load_items(self, window):
+        """ Reads items of fetched window """
+        with open(self._data_path(window), 'r') as file:
+            return json.load(file)
+
+    def mark_emitted(self, window):
+        """ Moves window to emitted state and drops its stored items """
+        with self.lock:
+            window['state'] = EMITTED
+            self.compact()
+            self.save()
+        if os.path.exists(self._data_path(window)):
+            os.remove(self._data_path(window))
+
+    def compact(self):
+        """ Forgets emitted windows before the first incomplete one,
+            keeping the last of them as the range marker
+        """
+        done = 0
+        for window in self.windows:
+            if window['state'] != EMITTED:
+                break
+            done += 1
+        if done > 1:
+            del self.windows[:done - 1]
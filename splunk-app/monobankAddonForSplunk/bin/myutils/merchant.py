@@ -0,0 +1,60 @@
+""" Normalization of merchant names in transaction descriptions """
+
+import re
+import logging
+from functools import lru_cache
+
+
+# distinct raw descriptions kept, almost all transactions hit the cache
+CACHE_SIZE = 8192
+# payment processor prefixes, e.g. PAYPAL *SPOTIFY
+PROCESSOR = re.compile(r'^(?:paypal|pp|sq|sumup|liqpay|wfp|fondy|portmone|ipay)\s*\*\s*')
+# terminal or order suffix after an asterisk, e.g. NETFLIX.COM*1234
+SUFFIX = re.compile(r'\*.*$')
+DOMAIN = re.compile(r'\.(?:com|ua|net|org|io|co|eu|me)\b')
+PATH = re.compile(r'/.*$')
+APOSTROPHE = re.compile(r"['`’ʼ]")
+NON_WORD = re.compile(r'[\W_]+')
+# tokens dropped anywhere in the name: cities, countries, legal forms
+STOP_TOKENS = frozenset((
+    'kyiv', 'kiev', 'київ', 'kyyiv', 'lviv', 'львів', 'odesa', 'odessa', 'одеса',
+    'kharkiv', 'харків', 'dnipro', 'дніпро', 'zaporizhzhia', 'vinnytsia',
+    'ua', 'ukr', 'ukraine', 'україна', 'usa', 'us', 'gb', 'ie', 'nl', 'de', 'pl', 'cy',
+    'llc', 'ltd', 'inc', 'bv', 'gmbh', 'tov', 'тов', 'фоп', 'fop', 'shop', 'store', 'магазин',
+))
+
+log = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def merchant_key(description):
+    """ Canonical merchant of description: lowercase words without
+        processor prefix, terminal suffix, domain and path, numbers,
+        locations and legal forms
+    """
+    name = description.lower().strip()
+    name = PROCESSOR.sub('', name)
+    name = SUFFIX.sub('', name)
+    name = PATH.sub('', DOMAIN.sub('', name))
+    name = APOSTROPHE.sub('', name)
+    tokens = [token for token in NON_WORD.split(name)
+              if token and token not in STOP_TOKENS and not any(char.isdigit()
+                                                                 for char in token)]
+    return ' '.join(tokens) or description.lower().strip()
+
+
+class MerchantNormalizer:
+    """ Window stage adding merchant field """
+
+    def __call__(self, items, account):
+        for item in items:
+            description = item.get('description')
+            if description:
+                item['merchant'] = merchant_key(description)
+        return items
+
+    def commit(self):
+        """ Logs cache efficiency once the window is written """
+        info = merchant_key.cache_info()
+        log.debug('Merchant cache', extra={'hits': info.hits, 'misses': info.misses,
+                                           'size': info.currsize})
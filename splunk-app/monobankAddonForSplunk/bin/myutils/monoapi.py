@@ -0,0 +1,118 @@
+""" Monobank personal API client """
+
+import time
+import hashlib
+import logging
+import requests
+from myutils.refcache import ReferenceCache
+from myutils.telemetry import RunStats
+
+
+API_URI = 'https://api.monobank.ua'
+# statement can be requested for max 31 days + 1 hour
+STATEMENT_MAX_SPAN = 31 * 24 * 3600 + 3600
+# statement returns max 500 transactions per call
+STATEMENT_PAGE_SIZE = 500
+# personal endpoints allow 1 call per 60 seconds
+CALL_INTERVAL = 60
+MAX_RETRIES = 3
+# (connect, read) seconds, a stalled connection must not block the fetching thread
+TIMEOUT = (10, 60)
+# reference data revalidation periods
+CLIENT_INFO_TTL = 24 * 3600
+CURRENCY_TTL = 3600
+
+log = logging.getLogger(__name__)
+
+
+class MonobankAPI:
+    """ Rate limited client for Monobank personal API """
+    # monotonic time of the last call, shared by all clients of the process
+    _last_call = {}
+
+    def __init__(self, token, interval=CALL_INTERVAL, cache=None, stats=None):
+        self.token = token
+        self.interval = interval
+        self.cache = cache if cache is not None else ReferenceCache()
+        self.stats = stats if stats is not None else RunStats()
+        # cache entry names must not reveal the token
+        self.token_key = hashlib.sha256(token.encode()).hexdigest()[:16]
+
+    def _wait(self, key):
+        """ Sleep until the next call fits into the rate limit """
+        last_call = self._last_call.get(key)
+        if last_call is not None:
+            delay = last_call + self.interval - time.monotonic()
+            if delay > 0:
+                log.debug('Waiting for rate limit', extra={'delay': delay})
+                with self.stats.phase('rate_limit_sleep'):
+                    time.sleep(delay)
+        self._last_call[key] = time.monotonic()
+
+    def get(self, path, headers=None, personal=True):
+        """ Rate limited GET, retried on HTTP 429 and timeouts """
+        headers = dict(headers or {})
+        if personal:
+            headers['X-Token'] = self.token
+        for attempt in range(MAX_RETRIES):
+            if attempt:
+                self.stats.add('retries')
+            self._wait(self.token if personal else path)
+            try:
+                with self.stats.phase('http'):
+                    response = requests.get(API_URI + path, headers=headers,
+                                            timeout=TIMEOUT)
+            except requests.Timeout:
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                log.warning('Request timed out, retrying', extra={'path': path})
+                continue
+            self.stats.add('http_calls')
+            self.stats.add('bytes_in', len(response.content))
+            if response.status_code != 429:
+                break
+            log.warning('Rate limit exceeded, retrying', extra={'path': path})
+        response.raise_for_status()
+        return response
+
+    def statement(self, account, from_ts, to_ts):
+        """ Get all transactions of account in [from_ts, to_ts] time range,
+            newest first as returned by Monobank
+        """
+        items = []
+        seen = set()
+        while True:
+            response = self.get('/personal/statement/' + str(account) + '/' +
+                                str(from_ts) + '/' + str(to_ts))
+            log.debug('Data received', extra={'data': str(response.content)})
+            with self.stats.phase('decode'):
+                page = response.json()
+            items.extend(item for item in page if item['id'] not in seen)
+            if len(page) < STATEMENT_PAGE_SIZE:
+                return items
+            # full page, the rest is not newer than the last returned transaction
+            seen.update(item['id'] for item in page)
+            if page[-1]['time'] == to_ts:
+                to_ts -= 1
+            else:
+                to_ts = page[-1]['time']
+            if to_ts < from_ts:
+                return items
+
+    def client_info(self):
+        """ Get cached client info with accounts and jars """
+        return self.cache.get('client-info-' + self.token_key, CLIENT_INFO_TTL,
+                              lambda headers: self.get('/personal/client-info', headers))
+
+    def currency(self):
+        """ Get cached currency rates """
+        return self.cache.get('currency', CURRENCY_TTL,
+                              lambda headers: self.get('/bank/currency', headers,
+                                                       personal=False))
+
+    def set_webhook(self, url):
+        """ Registers webhook URL for the token """
+        self._wait(self.token)
+        response = requests.post(API_URI + '/personal/webhook', json={'webHookUrl': url},
+                                 headers={'X-Token': self.token}, timeout=TIMEOUT)
+        response.raise_for_status()
@@ -0,0 +1,77 @@
+""" Producer/consumer stages of ingestion pipeline """
+
+import io
+import queue
+import threading
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """ Fetches windows in a background thread ahead of the consumer.
+        The bounded queue gives backpressure: at most depth windows
+        are kept in memory while the consumer writes events.
+    """
+    _DONE = object()
+
+    def __init__(self, windows, fetch, depth=2):
+        self.windows = windows
+        self.fetch = fetch
+        self.queue = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._produce, name='prefetch', daemon=True)
+
+    def _put(self, entry):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(entry, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for window in self.windows:
+                if not self._put((window, self.fetch(window))):
+                    return
+            self._put((None, self._DONE))
+        except Exception as exception:
+            # re-raised by the consumer
+            self._put((None, exception))
+
+    def __iter__(self):
+        """ Yields (window, items) in windows order """
+        self.thread.start()
+        try:
+            while True:
+                window, items = self.queue.get()
+                if items is self._DONE:
+                    return
+                if isinstance(items, Exception):
+                    raise items
+                yield window, items
+        finally:
+            self.stopped.set()
+
+
+class WindowOutput(io.TextIOBase):
+    """ Text stream for EventWriter which ignores the flush done after every
+        event; the stream is flushed once per window by commit()
+    """
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def write(self, data):
+        return self.stream.write(data)
+
+    def flush(self):
+        pass
+
+    def commit(self):
+        """ Flushes everything written so far """
+        self.stream.flush()
@@ -0,0 +1,165 @@
+""" Opt-in profiling of production runs """
+
+import os
+import sys
+import cProfile
+import pstats
+import io
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+
+PROFILE_ENV = 'MONOBANK_PROFILE'
+MODES = ('cprofile', 'tracemalloc', 'sample')
+# limits for one artifact and for all artifacts kept in the directory
+MAX_ARTIFACT_BYTES = 5 * 1024 * 1024
+MAX_TOTAL_BYTES = 50 * 1024 * 1024
+SAMPLE_INTERVAL = 0.01
+TOP_ENTRIES = 100
+
+log = logging.getLogger(__name__)
+
+
+class Profiler:
+    """ Context manager profiling the block with cProfile, tracemalloc or
+        periodic stack sampling and writing timestamped artifacts to out_dir.
+        cProfile profiles threads started in the block (prefetching) too, with
+        a profiler per thread merged into one artifact. Empty mode disables
+        profiling. Profilers do not nest: inside an active one (the
+        MONOBANK_PROFILE run) per-input profiling is skipped.
+    """
+    # profiler active in the process, a second cProfile or tracemalloc
+    # session would break it
+    _active = None
+
+    def __init__(self, mode, out_dir, name='run'):
+        self.mode = (mode or '').strip().lower()
+        self.out_dir = out_dir
+        self.name = name
+        self.profile = None
+        self.thread_profiles = []
+        self.samples = None
+        self.sampler = None
+        self.stopped = threading.Event()
+        if self.mode and self.mode not in MODES:
+            log.warning('Unknown profile mode', extra={'mode': self.mode})
+            self.mode = ''
+
+    def __enter__(self):
+        if self.mode and Profiler._active is not None:
+            log.warning('Profiling is already active, nested profile is skipped',
+                        extra={'mode': self.mode, 'active': Profiler._active.mode})
+            self.mode = ''
+        if self.mode:
+            Profiler._active = self
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            threading.setprofile(self._profile_thread)
+            self.profile.enable()
+        elif self.mode == 'tracemalloc':
+            tracemalloc.start(25)
+        elif self.mode == 'sample':
+            self.samples = Counter()
+            self.sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),),
+                                            name='profile-sampler', daemon=True)
+            self.sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.mode:
+            return False
+        Profiler._active = None
+        try:
+            if self.mode == 'cprofile':
+                self.profile.disable()
+                threading.setprofile(None)
+                self._write_cprofile()
+            elif self.mode == 'tracemalloc':
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self._write_tracemalloc(snapshot, current, peak)
+            elif self.mode == 'sample':
+                self.stopped.set()
+                self.sampler.join()
+                self._write_samples()
+            self._prune()
+        except Exception:
+            # profiling must never break ingestion
+            log.exception('Failed to write profile')
+        return False
+
+    def _profile_thread(self, *_):
+        """ Profile hook of a new thread, replaced by its own cProfile """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one active cProfile per process
+            return
+        self.thread_profiles.append(profile)
+
+    def _artifact_path(self, extension):
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        return os.path.join(self.out_dir, '%s-%s-%d.%s' % (self.name, stamp, os.getpid(),
+                                                           extension))
+
+    def _write_text(self, extension, text):
+        path = self._artifact_path(extension)
+        data = text.encode('utf-8')[:MAX_ARTIFACT_BYTES]
+        with open(path, 'wb') as file:
+            file.write(data)
+        log.info('Profile written', extra={'path': path})
+
+    def _write_cprofile(self):
+        report = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=report)
+        for profile in self.thread_profiles:
+            stats.add(profile)
+        path = self._artifact_path('prof')
+        stats.dump_stats(path)
+        if os.path.getsize(path) > MAX_ARTIFACT_BYTES:
+            os.remove(path)
+        stats.sort_stats('cumulative').print_stats(TOP_ENTRIES)
+        self._write_text('cprofile.txt', report.getvalue())
+
+    def _write_tracemalloc(self, snapshot, current, peak):
+        lines = ['current=%d peak=%d' % (current, peak)]
+        for stat in snapshot.statistics('traceback')[:TOP_ENTRIES]:
+            lines.append('%d KiB in %d blocks' % (stat.size / 1024, stat.count))
+            lines.extend('    ' + line for line in stat.traceback.format())
+        self._write_text('tracemalloc.txt', '\n'.join(lines) + '\n')
+
+    def _sample(self, thread_id):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            for frame_thread_id, frame in sys._current_frames().items():
+                if frame_thread_id == threading.get_ident():
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s:%s:%d' % (os.path.basename(code.co_filename),
+                                               code.co_name, frame.f_lineno))
+                    frame = frame.f_back
+                prefix = 'main' if frame_thread_id == thread_id else 'thread'
+                self.samples[prefix + ';' + ';'.join(reversed(stack))] += 1
+
+    def _write_samples(self):
+        # collapsed stacks, usable by flamegraph tools
+        lines = ['%s %d' % (stack, count) for stack, count in self.samples.most_common()]
+        self._write_text('folded', '\n'.join(lines) + '\n')
+
+    def _prune(self):
+        """ Removes oldest artifacts above total size limit """
+        paths = [os.path.join(self.out_dir, name) for name in os.listdir(self.out_dir)]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        total = 0
+        for path in paths:
+            total += os.path.getsize(path)
+            if total > MAX_TOTAL_BYTES:
+                os.remove(path)
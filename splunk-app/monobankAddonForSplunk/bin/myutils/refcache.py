@@ -0,0 +1,82 @@
+""" Memory and disk cache for rarely changing reference data """
+
+import os
+import json
+import time
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class ReferenceCache:
+    """ Keeps reference data (currency rates, account metadata) in memory
+        and on disk. Entries older than ttl are revalidated with
+        ETag/Last-Modified when the source supports it.
+    """
+    # entries of the process, by name
+    _memory = {}
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name + '.json')
+
+    def _read(self, name):
+        entry = self._memory.get(name)
+        if entry is None and self.cache_dir is not None and os.path.exists(self._path(name)):
+            with open(self._path(name), 'r') as file:
+                entry = json.load(file)
+            self._memory[name] = entry
+        return entry
+
+    def _write(self, name, entry):
+        self._memory[name] = entry
+        if self.cache_dir is not None:
+            tmp_path = self._path(name) + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(entry, file)
+            os.replace(tmp_path, self._path(name))
+
+    def age(self, name):
+        """ Seconds since entry was fetched, None if not cached """
+        entry = self._read(name)
+        if entry is None:
+            return None
+        return time.time() - entry['fetched']
+
+    def get(self, name, ttl, fetch):
+        """ Get cached data, calling fetch(headers) if it is older than ttl.
+            fetch returns requests.Response-like object; 304 keeps cached data.
+        """
+        entry = self._read(name)
+        now = time.time()
+        if entry is not None and now - entry['fetched'] < ttl:
+            return entry['data']
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = fetch(headers)
+        except Exception:
+            if entry is None:
+                raise
+            log.warning('Using stale reference data', extra={'name': name})
+            return entry['data']
+        if response.status_code == 304 and entry is not None:
+            entry['fetched'] = now
+        else:
+            entry = {
+                'fetched': now,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'data': response.json()
+            }
+        self._write(name, entry)
+        return entry['data']
@@ -0,0 +1,115 @@
+""" Daily spend rollups, emitted as Splunk metrics """
+
+import os
+import json
+from datetime import datetime, timedelta
+import pytz
+from myutils.journal import safe_name
+
+
+TZ = pytz.timezone('Europe/Kiev')
+# days older than the newest rolled up day by more than this are forgotten
+RETENTION_DAYS = 93
+
+
+class DailyRollup:
+    """ Incremental per Kyiv calendar day aggregates of transactions by
+        (card, currencyCode, mcc): amount sum, count, min and max,
+        operationAmount and cashbackAmount sums, all in minor units.
+        Contribution of every transaction is kept per day, so windows
+        re-emitted after a crash are not counted twice and updated
+        transactions replace their previous values. Only groups whose
+        aggregates changed are emitted, with sums and count as deltas
+        against the previously emitted values, so points are safe to sum.
+    """
+
+    def __init__(self, checkpoint_dir, name):
+        self.path = os.path.join(checkpoint_dir, safe_name(name) + '.rollups.json')
+        self.days = {}
+        # {day: {group key: [amount sum, count, operationAmount sum, cashbackAmount sum]}}
+        self.emitted = {}
+        self.touched = set()
+
+    def load(self):
+        """ Reads rollup state from disk """
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                state = json.load(file)
+            self.days = state['days']
+            self.emitted = state['emitted']
+        return self
+
+    def save(self):
+        """ Atomically writes rollup state, dropping days out of retention """
+        if self.days:
+            oldest = (datetime.strptime(max(self.days), '%Y-%m-%d') -
+                      timedelta(days=RETENTION_DAYS)).strftime('%Y-%m-%d')
+            for day in [day for day in self.days if day < oldest]:
+                del self.days[day]
+                self.emitted.pop(day, None)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'days': self.days, 'emitted': self.emitted}, file)
+        os.replace(tmp_path, self.path)
+
+    def add(self, items, card):
+        """ Adds window items of card to the daily aggregates,
+            updated items replace their previous contribution
+        """
+        for item in items:
+            day = datetime.fromtimestamp(item['time'], TZ).strftime('%Y-%m-%d')
+            rollup = self.days.get(day)
+            if rollup is None:
+                rollup = self.days[day] = {}
+            previous = rollup.get(item['id'])
+            if previous is not None and not item.get('updated'):
+                continue
+            contribution = ['%s|%s|%s' % (card, item.get('currencyCode'), item.get('mcc')),
+                            item['amount'], item.get('operationAmount', 0),
+                            item.get('cashbackAmount', 0)]
+            if contribution == previous:
+                continue
+            rollup[item['id']] = contribution
+            self.touched.add((day, contribution[0]))
+            if previous is not None:
+                self.touched.add((day, previous[0]))
+
+    @staticmethod
+    def _group(rollup, key):
+        """ [sum, count, min, max, operationAmount sum, cashbackAmount sum] of group """
+        amounts = [entry for entry in rollup.values() if entry[0] == key]
+        if not amounts:
+            return [0, 0, None, None, 0, 0]
+        return [sum(entry[1] for entry in amounts), len(amounts),
+                min(entry[1] for entry in amounts), max(entry[1] for entry in amounts),
+                sum(entry[2] for entry in amounts), sum(entry[3] for entry in amounts)]
+
+    def pop_touched(self):
+        """ Yields (day start timestamp, metric record) of groups changed
+            since the last call
+        """
+        for day, key in sorted(self.touched):
+            group = self._group(self.days[day], key)
+            emitted = self.emitted.setdefault(day, {})
+            previous = emitted.get(key, [0, 0, 0, 0])
+            current = [group[0], group[1], group[4], group[5]]
+            if current == previous:
+                continue
+            emitted[key] = current
+            card, currency_code, mcc = key.split('|')
+            record = {
+                'day': day,
+                'card': card,
+                'currencyCode': currency_code,
+                'mcc': mcc,
+                'monobank.amount.sum': current[0] - previous[0],
+                'monobank.amount.count': current[1] - previous[1],
+                'monobank.operationAmount.sum': current[2] - previous[2],
+                'monobank.cashbackAmount.sum': current[3] - previous[3]
+            }
+            if group[1]:
+                record['monobank.amount.min'] = group[2]
+                record['monobank.amount.max'] = group[3]
+            day_start = TZ.localize(datetime.strptime(day, '%Y-%m-%d')).timestamp()
+            yield day_start, record
+        self.touched = set()
@@ -0,0 +1,159 @@
+""" Index of already ingested transactions """
+
+import os
+import json
+import time
+import hashlib
+from myutils.journal import safe_name
+
+
+# transactions older than the newest seen one by more than this are forgotten
+RETENTION = 62 * 24 * 3600
+# kept beyond the revisited days, windows start before the newest transaction
+REVISIT_MARGIN = 31 * 24 * 3600
+
+
+def retention(revisit_days):
+    """ Retention of ids which covers revisit_days with margin, at least
+        RETENTION, so revisited transactions are never forgotten as new
+    """
+    return max(RETENTION, revisit_days * 24 * 3600 + REVISIT_MARGIN)
+
+
+def content_hash(item):
+    """ Compact hash of statement item content """
+    data = json.dumps(item, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+class SeenIndex:
+    """ Persistent transaction id -> [time, content hash] index, used to drop
+        transactions which were already ingested by another path (webhook vs
+        statement) and to detect transactions changed after ingestion.
+        Retention None keeps all entries. since is the creation time of the
+        index: a transaction of a later time was not ingested before it.
+    """
+
+    def __init__(self, checkpoint_dir, name, retention=RETENTION):
+        self.path = os.path.join(checkpoint_dir, safe_name(name) + '.seen.json')
+        self.retention = retention
+        self.items = {}
+        self.since = int(time.time())
+        self.changed = True
+
+    def load(self):
+        """ Reads index from disk """
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                state = json.load(file)
+            if 'items' in state:
+                self.items = state['items']
+                self.since = state['since']
+                self.changed = False
+            else:
+                # index of earlier versions, its creation time is unknown
+                self.items = state
+        return self
+
+    def save(self):
+        """ Prunes old entries and atomically writes index to disk """
+        if not self.changed:
+            return
+        if self.items and self.retention is not None:
+            oldest = max(entry[0] for entry in self.items.values()) - self.retention
+            self.items = {item_id: entry for item_id, entry in self.items.items()
+                          if entry[0] >= oldest}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'since': self.since, 'items': self.items}, file,
+                      separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+    def check(self, item):
+        """ Records item, returns None for a new item, True if its content
+            changed since it was seen and False if it is unchanged
+        """
+        digest = content_hash(item)
+        entry = self.items.get(item['id'])
+        if entry is not None and entry[1] == digest:
+            return False
+        self.items[item['id']] = [item['time'], digest]
+        self.changed = True
+        return None if entry is None else True
+
+
+class ChangeDetector:
+    """ Window stage dropping transactions present in seen index with the same
+        content. Changed transactions (e.g. hold settled) are passed with
+        updated = true. In revisit windows, which were written before, new
+        transactions are passed too (e.g. posted late), except those older than
+        the index: they were written before the index existed.
+    """
+
+    def __init__(self, seen):
+        self.seen = seen
+
+    def __call__(self, items, account):
+        revisit = account.get('revisit', False)
+        since = self.seen.since
+        changes = []
+        for item in items:
+            changed = self.seen.check(item)
+            if changed:
+                item['updated'] = True
+                changes.append(item)
+            elif changed is None and (not revisit or item['time'] >= since):
+                changes.append(item)
+        return changes
+
+    def commit(self):
+        """ Persists index once the window is written """
+        self.seen.save()
+
+
+class SeenLog(SeenIndex):
+    """ SeenIndex without retention for imported history, kept as an append
+        only log: save appends only entries recorded since the previous save
+        to <name>.seen.log, one JSON line [id, time, content hash] each, the
+        last line of an id wins
+    """
+
+    def __init__(self, checkpoint_dir, name):
+        super().__init__(checkpoint_dir, name, retention=None)
+        self.path = os.path.join(checkpoint_dir, safe_name(name) + '.seen.log')
+        self.added = []
+
+    def load(self):
+        """ Reads log from disk, cutting incomplete last line """
+        if os.path.exists(self.path):
+            end = 0
+            with open(self.path, 'rb+') as file:
+                for line in file:
+                    if not line.endswith(b'\n'):
+                        break
+                    item_id, item_time, digest = json.loads(line)
+                    self.items[item_id] = [item_time, digest]
+                    end += len(line)
+                file.truncate(end)
+        self.changed = False
+        return self
+
+    def check(self, item):
+        changed = super().check(item)
+        if changed is not False:
+            self.added.append(item['id'])
+        return changed
+
+    def save(self):
+        """ Appends entries recorded since the previous save """
+        if not self.added:
+            return
+        with open(self.path, 'a') as file:
+            for item_id in self.added:
+                file.write(json.dumps([item_id] + self.items[item_id],
+                                      separators=(',', ':')) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self.added = []
+        self.changed = False
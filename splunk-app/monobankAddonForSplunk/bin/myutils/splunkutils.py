@@ -1,4 +1,5 @@
 import logging
+import time
 from datetime import datetime, timedelta
 import splunklib.client
 import splunklib.results
@@ -183,26 +184,29 @@ class ModularInput:
         file.close()
         return checkpoint
 
+    @staticmethod
+    def _latest_timestamp(splunk, service, splunk_query, splunk_earliest):
+        """Latest logged timestamp found by the query, 0 if there is none"""
+        results = splunk.search(service, splunk_query, splunk_earliest)
+        timestamp = 0
+        for event in results:
+            timestamp = float(event['timestamp'])
+        return timestamp
+
+    @staticmethod
+    def _start_datetime(timestamp, user_init_datetime):
+        """Naive UTC datetime after the latest logged timestamp, or init datetime"""
+        if timestamp <= 0:
+            return user_init_datetime
+        return datetime.utcfromtimestamp(timestamp) + timedelta(seconds=1)
+
     def get_init_date(self, splunk, splunk_query, splunk_args, user_init_date_str):
         """Get latest logged timestamp from Splunk"""
         user_init_date_str_parts = user_init_date_str.split('-')
         user_init_datetime = datetime(int(user_init_date_str_parts[0]),
                                       int(user_init_date_str_parts[1]),
                                       int(user_init_date_str_parts[2]))
-        splunk_earliest = float((user_init_datetime - datetime(1970, 1, 1))
-                                .total_seconds())
-        # Splunk connection
-        service = splunk.connect(**splunk_args)
-        results = splunk.search(service, splunk_query, splunk_earliest)
-        timestamp = 0
-        for event in results:
-            timestamp = float(event['timestamp'])
-        utc_last_datetime = datetime.fromtimestamp(timestamp)
-        if float(timestamp) <= 0 or utc_last_datetime is None:
-            start_datetime = user_init_datetime
-        else:
-            start_datetime = utc_last_datetime + timedelta(seconds=1)
-        return start_datetime
+        return self.get_init_datetime(splunk, splunk_query, splunk_args, user_init_datetime)
 
     def get_init_datetime(self, splunk, splunk_query, splunk_args, user_init_datetime):
         """Get latest logged timestamp from Splunk"""
@@ -210,13 +214,22 @@ class ModularInput:
                                 .total_seconds())
         # Splunk connection
         service = splunk.connect(**splunk_args)
-        results = splunk.search(service, splunk_query, splunk_earliest)
-        timestamp = 0
-        for event in results:
-            timestamp = float(event['timestamp'])
-        utc_last_datetime = datetime.fromtimestamp(timestamp)
-        if float(timestamp) <= 0 or utc_last_datetime is None:
-            start_datetime = user_init_datetime
-        else:
-            start_datetime = utc_last_datetime + timedelta(seconds=1)
-        return start_datetime
+        timestamp = self._latest_timestamp(splunk, service, splunk_query, splunk_earliest)
+        return self._start_datetime(timestamp, user_init_datetime)
+
+    def get_init_datetime_bounded(self, splunk, splunk_query, splunk_args, user_init_datetime,
+                                  span):
+        """Get latest logged timestamp from Splunk, searching the last span seconds
+        first and doubling the range until something is found or init date is reached"""
+        splunk_init = float((user_init_datetime - datetime(1970, 1, 1))
+                            .total_seconds())
+        now = time.time()
+        # Splunk connection
+        service = splunk.connect(**splunk_args)
+        while True:
+            splunk_earliest = max(now - span, splunk_init)
+            timestamp = self._latest_timestamp(splunk, service, splunk_query, splunk_earliest)
+            if timestamp > 0 or splunk_earliest <= splunk_init:
+                break
+            span *= 2
+        return self._start_datetime(timestamp, user_init_datetime)
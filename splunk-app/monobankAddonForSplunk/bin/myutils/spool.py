@@ -0,0 +1,185 @@
+""" Disk-backed spool of events between fetching and splunkd """
+
+import os
+import json
+import mmap
+import logging
+import threading
+from myutils.journal import safe_name
+
+
+SEGMENT_BYTES = 16 * 1024 * 1024
+# records written to the consumer between position commits
+DRAIN_BATCH = 1000
+
+log = logging.getLogger(__name__)
+
+
+class Spool:
+    """ Append-only segmented spool of JSON records in <name>.spool.
+        The producer appends records and syncs them once per window, a
+        background thread reads synced records through mmap, writes them to
+        the consumer and persists its read position after every batch, so
+        records spooled before a restart are written by the next run.
+        Every sync ends with an empty line: records after the last one were
+        not committed by the producer and are never read.
+    """
+
+    def __init__(self, checkpoint_dir, name):
+        self.dir = os.path.join(checkpoint_dir, safe_name(name) + '.spool')
+        self.position_path = os.path.join(self.dir, 'position.json')
+        self.cond = threading.Condition()
+        self.file = None
+        # active segment of the producer and its synced size
+        self.segment = None
+        self.synced = 0
+        self.pending = False
+        self.closed = False
+        self.error = None
+        self.thread = None
+
+    def _path(self, segment):
+        return os.path.join(self.dir, '%012d.seg' % segment)
+
+    def _segments(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.dir) if name.endswith('.seg'))
+
+    def _load_position(self):
+        if os.path.exists(self.position_path):
+            with open(self.position_path, 'r') as file:
+                position = json.load(file)
+            return position['segment'], position['offset']
+        return 0, 0
+
+    def _save_position(self, segment, offset):
+        tmp_path = self.position_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'segment': segment, 'offset': offset}, file)
+        os.replace(tmp_path, self.position_path)
+
+    def open(self, write, commit):
+        """ Starts draining records with write(record), commit() is called
+            before the read position is persisted
+        """
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+        segments = self._segments()
+        position = self._load_position()
+        if segments:
+            log.info('Draining spooled events', extra={'segments': len(segments)})
+        # new segment on every start, a crash may leave a partial record
+        self.segment = max(segments[-1] + 1 if segments else 0, position[0])
+        self.file = open(self._path(self.segment), 'ab')
+        self.thread = threading.Thread(target=self._drain, args=(write, commit, position),
+                                       name='spool', daemon=True)
+        self.thread.start()
+        return self
+
+    def append(self, record):
+        """ Appends record, visible to the consumer after sync() """
+        if self.error is not None:
+            raise self.error
+        self.file.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+        self.pending = True
+        if self.file.tell() >= SEGMENT_BYTES:
+            self.sync()
+            self.file.close()
+            with self.cond:
+                self.segment += 1
+                self.synced = 0
+                self.file = open(self._path(self.segment), 'ab')
+
+    def sync(self):
+        """ Makes appended records durable and available to the consumer """
+        if not self.pending:
+            return
+        self.file.write(b'\n')
+        self.pending = False
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        with self.cond:
+            self.synced = self.file.tell()
+            self.cond.notify()
+
+    def close(self, commit=True):
+        """ Waits until all records are written to the consumer, records
+            appended after the last sync are dropped unless commit is set
+        """
+        if self.closed:
+            return
+        if commit:
+            self.sync()
+        else:
+            self.file.truncate(self.synced)
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+    def _available(self, segment, offset):
+        """ (readable size, sealed) of segment, called with cond held """
+        if segment < self.segment:
+            return self._committed_size(segment), True
+        return self.synced, self.closed
+
+    def _drain(self, write, commit, position):
+        try:
+            segment, offset = position
+            while True:
+                if not os.path.exists(self._path(segment)):
+                    later = [number for number in self._segments() if number > segment]
+                    segment, offset = (later[0] if later else self.segment), 0
+                with self.cond:
+                    size, sealed = self._available(segment, offset)
+                    while size <= offset and not sealed:
+                        self.cond.wait()
+                        size, sealed = self._available(segment, offset)
+                offset = self._read(segment, offset, size, write, commit)
+                if sealed and offset >= size:
+                    os.remove(self._path(segment))
+                    if segment >= self.segment:
+                        self._save_position(segment + 1, 0)
+                        return
+                    segment, offset = segment + 1, 0
+                    self._save_position(segment, offset)
+        except Exception as exception:
+            # re-raised by the producer
+            self.error = exception
+
+    def _committed_size(self, segment):
+        """ Size of segment up to the end of the last sync """
+        size = os.path.getsize(self._path(segment))
+        if not size:
+            return 0
+        with open(self._path(segment), 'rb') as file:
+            with mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as data:
+                end = data.rfind(b'\n\n')
+        return end + 2 if end >= 0 else 0
+
+    def _read(self, segment, offset, size, write, commit):
+        """ Writes complete records of segment between offset and size,
+            returns the new read position
+        """
+        if size <= offset:
+            return offset
+        with open(self._path(segment), 'rb') as file:
+            with mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as data:
+                count = 0
+                while True:
+                    end = data.find(b'\n', offset, size)
+                    if end < 0:
+                        break
+                    if end > offset:
+                        write(json.loads(data[offset:end]))
+                        count += 1
+                    offset = end + 1
+                    if count >= DRAIN_BATCH:
+                        commit()
+                        self._save_position(segment, offset)
+                        count = 0
+        commit()
+        self._save_position(segment, offset)
+        return offset
@@ -0,0 +1,86 @@
+""" Tagging of events superseded by later versions of their transactions """
+
+import os
+import json
+import logging
+from myutils.journal import safe_name
+
+
+# KV store collection of superseded (id, revision), see collections.conf
+COLLECTION = 'monobank_superseded'
+# documents per KV store batch_save, the default server limit
+BATCH_SIZE = 1000
+# revisions of transactions older than the newest one by more than this are forgotten
+RETENTION = 62 * 24 * 3600
+
+log = logging.getLogger(__name__)
+
+
+class Supersessions:
+    """ Numbers versions of transactions written again (updated = true):
+        the first event of a transaction has no revision (0), every later one
+        revision = previous + 1. Id and revision of the superseded event are
+        saved to the KV store collection COLLECTION, which the automatic
+        lookup monobank_superseded maps to superseded = true, so reports drop
+        old versions with a plain NOT superseded=true. Records which could not
+        be saved are persisted and saved with the next window.
+    """
+
+    def __init__(self, checkpoint_dir, name, connect, retention=RETENTION):
+        self.path = os.path.join(checkpoint_dir, safe_name(name) + '.revisions.json')
+        # returns splunklib service of the app
+        self.connect = connect
+        self.retention = retention
+        # {transaction id: [time, revision of its last event]}
+        self.revisions = {}
+        self.pending = []
+        self.changed = False
+
+    def load(self):
+        """ Reads revisions and unsaved records from disk """
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                state = json.load(file)
+            self.revisions = state['revisions']
+            self.pending = state['pending']
+        return self
+
+    def revise(self, item):
+        """ Sets revision of updated item, its previous event is superseded """
+        if not item.get('updated'):
+            return
+        entry = self.revisions.get(item['id'])
+        revision = entry[1] if entry is not None else 0
+        self.pending.append({'_key': '%s:%d' % (item['id'], revision), 'id': item['id'],
+                             'revision': revision, 'superseded': 'true'})
+        item['revision'] = revision + 1
+        self.revisions[item['id']] = [item['time'], revision + 1]
+        self.changed = True
+
+    def _save_records(self):
+        data = self.connect().kvstore[COLLECTION].data
+        while self.pending:
+            data.batch_save(*self.pending[:BATCH_SIZE])
+            del self.pending[:BATCH_SIZE]
+
+    def commit(self):
+        """ Saves superseded records once their replacements are written and
+            atomically writes state
+        """
+        if not self.changed:
+            return
+        try:
+            self._save_records()
+        except Exception:
+            log.warning('Superseded events are not saved, retried with the next window',
+                        exc_info=True, extra={'records': len(self.pending)})
+        if self.revisions:
+            oldest = max(entry[0] for entry in self.revisions.values()) - self.retention
+            self.revisions = {item_id: entry for item_id, entry in self.revisions.items()
+                              if entry[0] >= oldest}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'revisions': self.revisions, 'pending': self.pending}, file,
+                      separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self.changed = bool(self.pending)
@@ -0,0 +1,60 @@
+""" Per-run performance telemetry """
+
+import time
+import threading
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+from contextlib import contextmanager
+
+
+class RunStats:
+    """ Phase timings and counters of one modular input run.
+        Updated from fetch and writer threads.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.counters = {}
+        self.maximums = {}
+        self.lock = threading.Lock()
+
+    def add_time(self, phase, seconds):
+        """ Adds seconds spent in phase """
+        with self.lock:
+            self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+            if seconds > self.maximums.get(phase, 0.0):
+                self.maximums[phase] = seconds
+
+    def add(self, counter, value=1):
+        """ Increments counter """
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    @contextmanager
+    def phase(self, name):
+        """ Times the block as phase """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def summary(self):
+        """ Flat record of the run: <phase>_seconds, <phase>_max_seconds,
+            counters and peak RSS where the platform reports it
+        """
+        with self.lock:
+            record = {'wall_seconds': round(time.perf_counter() - self.started, 6)}
+            for phase, seconds in sorted(self.timings.items()):
+                record[phase + '_seconds'] = round(seconds, 6)
+            for phase, seconds in sorted(self.maximums.items()):
+                record[phase + '_max_seconds'] = round(seconds, 6)
+            record.update(sorted(self.counters.items()))
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux
+            record['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return record
@@ -0,0 +1,140 @@
+""" Matching of transfers between own accounts """
+
+import os
+import json
+import hashlib
+from collections import defaultdict
+from myutils.journal import safe_name
+
+
+# legs are looked up in the bucket of the time and its neighbours
+BUCKET = 60
+# unmatched legs older than the newest one by more than this are forgotten
+RETENTION = 3600
+# transferId of matched legs, to tag their updated versions, is kept this long
+PAIR_RETENTION = 62 * 24 * 3600
+
+
+def transfer_id(first_id, second_id):
+    """ Id shared by both legs of a transfer """
+    data = '|'.join(sorted((first_id, second_id))).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def operation_amount(item):
+    """ Amount in the operation currency (currencyCode) """
+    return item.get('operationAmount', item['amount'])
+
+
+class TransferMatcher:
+    """ Window stage pairing a debit of one account with a credit of the same
+        absolute operation amount and currency of another account within a
+        minute or two, through a short-lived index keyed on (abs operation
+        amount, currency, time bucket); amounts in the card currency differ
+        for cards in different currencies. Both legs get transferId. A leg
+        which was already written when its pair arrives is written again with
+        updated = true. transferId of matched legs is persisted and set on
+        their later versions (updated, revisit windows), which are not matched.
+    """
+
+    def __init__(self, checkpoint_dir, name, retention=PAIR_RETENTION):
+        self.path = os.path.join(checkpoint_dir, safe_name(name) + '.transfers.json')
+        self.retention = retention
+        self.index = defaultdict(list)
+        self.newest = 0
+        # legs of windows not written yet are tagged in place
+        self.pending = []
+        self.reemits = []
+        # {transaction id: [time, transferId]}
+        self.pairs = {}
+        self.changed = False
+
+    def load(self):
+        """ Reads transferId of matched legs from disk """
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                self.pairs = json.load(file)
+        return self
+
+    def __call__(self, items, account):
+        revisit = account.get('revisit')
+        for item in items:
+            if revisit or item.get('updated'):
+                pair = self.pairs.get(item['id'])
+                if pair is not None:
+                    item['transferId'] = pair[1]
+                continue
+            if not operation_amount(item):
+                continue
+            leg = self._match(item, account)
+            if leg is None:
+                entry = [item, account, False]
+                self.index[self._key(item, item['time'] // BUCKET)].append(entry)
+                self.pending.append(entry)
+                continue
+            other, other_account, emitted = leg
+            item['transferId'] = transfer_id(item['id'], other['id'])
+            self.pairs[item['id']] = [item['time'], item['transferId']]
+            self.pairs[other['id']] = [other['time'], item['transferId']]
+            self.changed = True
+            if emitted:
+                other = dict(other, transferId=item['transferId'], updated=True)
+                self.reemits.append((other, other_account))
+            else:
+                other['transferId'] = item['transferId']
+            self.newest = max(self.newest, item['time'])
+        return items
+
+    @staticmethod
+    def _key(item, bucket):
+        return abs(operation_amount(item)), item.get('currencyCode'), bucket
+
+    def _match(self, item, account):
+        """ Removes and returns the closest unmatched opposite leg of another
+            account, None if there is none
+        """
+        best = None
+        bucket = item['time'] // BUCKET
+        for key in (self._key(item, bucket + offset) for offset in (0, -1, 1)):
+            for entry in self.index.get(key, ()):
+                other = entry[0]
+                if entry[1]['id'] == account['id'] or \
+                        (operation_amount(other) > 0) == (operation_amount(item) > 0):
+                    continue
+                if best is None or abs(other['time'] - item['time']) < \
+                        abs(best[1][0]['time'] - item['time']):
+                    best = (key, entry)
+        if best is None:
+            return None
+        key, entry = best
+        self.index[key].remove(entry)
+        if not self.index[key]:
+            del self.index[key]
+        return entry
+
+    def pop_reemits(self):
+        """ (item, account) of written legs tagged since the last call """
+        reemits, self.reemits = self.reemits, []
+        return reemits
+
+    def commit(self):
+        """ Marks legs as written, forgets old unmatched legs and atomically
+            writes transferId of matched legs
+        """
+        for entry in self.pending:
+            entry[2] = True
+            self.newest = max(self.newest, entry[0]['time'])
+        self.pending = []
+        oldest = (self.newest - RETENTION) // BUCKET
+        for key in [key for key in self.index if key[2] < oldest]:
+            del self.index[key]
+        if not self.changed:
+            return
+        oldest = max(entry[0] for entry in self.pairs.values()) - self.retention
+        self.pairs = {item_id: entry for item_id, entry in self.pairs.items()
+                      if entry[0] >= oldest}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.pairs, file, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self.changed = False
@@ -0,0 +1,135 @@
+""" Receiver of Monobank webhook StatementItem posts """
+
+import sys
+import json
+import queue
+import logging
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+MAX_BODY = 64 * 1024
+QUEUE_SIZE = 10000
+REQUIRED_FIELDS = ('id', 'time', 'amount', 'balance')
+
+log = logging.getLogger(__name__)
+
+
+def parse_listen(listen):
+    """ Parse host:port, host defaults to localhost """
+    host, _, port = listen.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class WebhookReceiver:
+    """ Local HTTP listener for webhook posts. Valid StatementItem posts of
+        known accounts are acknowledged and queued as (account, item).
+    """
+
+    def __init__(self, listen, path, accounts):
+        self.path = path or '/'
+        self.accounts = set(accounts)
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.server = ThreadingHTTPServer(parse_listen(listen), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='webhook',
+                                       daemon=True)
+
+    def start(self):
+        """ Starts listening in background thread """
+        self.thread.start()
+        log.info('Webhook receiver started',
+                 extra={'address': '%s:%d' % self.server.server_address[:2]})
+
+    def stop(self):
+        """ Stops listening """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def drain(self, timeout=0):
+        """ Yields queued (account, item), waiting up to timeout for the first one """
+        try:
+            entry = self.queue.get(timeout=timeout) if timeout else self.queue.get_nowait()
+        except queue.Empty:
+            return
+        yield entry
+        while True:
+            try:
+                yield self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def validate(self, body):
+        """ Returns (account, item) of valid StatementItem post, raises ValueError """
+        post = json.loads(body)
+        if not isinstance(post, dict) or post.get('type') != 'StatementItem':
+            raise ValueError('Not a StatementItem post')
+        data = post.get('data') or {}
+        account = data.get('account')
+        item = data.get('statementItem')
+        if account not in self.accounts:
+            raise ValueError('Unknown account')
+        if not isinstance(item, dict) or any(field not in item for field in REQUIRED_FIELDS):
+            raise ValueError('Incomplete statement item')
+        return account, item
+
+    def _handler(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """ Monobank checks the URL with GET and posts items with POST """
+
+            def _reply(self, code):
+                self.send_response(code)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                self._reply(200 if self.path == receiver.path else 404)
+
+            def do_POST(self):
+                if self.path != receiver.path:
+                    self._reply(404)
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                if length <= 0 or length > MAX_BODY:
+                    self._reply(413 if length > MAX_BODY else 400)
+                    return
+                try:
+                    entry = receiver.validate(self.rfile.read(length))
+                except ValueError as exception:
+                    log.warning('Invalid webhook post', extra={'reason': str(exception)})
+                    self._reply(400)
+                    return
+                try:
+                    receiver.queue.put_nowait(entry)
+                except queue.Full:
+                    # Monobank retries posts which are not acknowledged
+                    self._reply(503)
+                    return
+                self._reply(200)
+
+            def log_message(self, format, *args):
+                log.debug(format, *args)
+
+        return Handler
+
+
+def post_statement_item(url, account, item):
+    """ Posts statement item like Monobank does, returns HTTP status """
+    body = json.dumps({'type': 'StatementItem',
+                       'data': {'account': account, 'statementItem': item}}).encode('utf-8')
+    request = urllib.request.Request(url, data=body, method='POST',
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+if __name__ == '__main__':
+    # local poster: python -m myutils.webhook <url> <account> <statement item json>
+    print(post_statement_item(sys.argv[1], sys.argv[2], json.loads(sys.argv[3])))